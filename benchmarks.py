@@ -0,0 +1,450 @@
+# benchmarks.py
+
+import os
+import re
+import sys
+import copy
+import json
+import time
+import subprocess
+import faiss
+import numpy as np
+import torch
+from transformers import AutoTokenizer, AutoModel
+import vector_utils_advanced as vu
+
+MODEL_NAME = "BAAI/bge-base-zh"
+CUSTOM_SYNONYM_PATH = "/content/Weather-AI-Agent/flattened_sememe_synonym.json"
+SEMEME_SYNONYM_PATH = "/content/Weather-AI-Agent/sememe_synonym.json"
+NLPCC_INDEX_PATH = "/content/index.faiss"
+NLPCC_META_PATH = "/content/metadata.jsonl"
+CUSTOM_INDEX_PATH = "/content/custom_index.faiss"
+CUSTOM_META_PATH = "/content/custom_metadata.jsonl"
+
+ANN_CONFIGS = [
+    {"index_type": "flat"},
+    {"index_type": "ivf_flat", "nprobe": 1},
+    {"index_type": "ivf_flat", "nprobe": 8},
+    {"index_type": "ivf_flat", "nprobe": 32},
+    {"index_type": "hnsw", "hnsw_m": 32, "ef_search": 16},
+    {"index_type": "hnsw", "hnsw_m": 32, "ef_search": 64},
+    {"index_type": "hnsw", "hnsw_m": 32, "ef_search": 256},
+    {"index_type": "ivf_pq", "pq_m": 48, "nprobe": 8},
+    {"index_type": "ivf_pq", "pq_m": 48, "nprobe": 32},
+]
+
+# 向量儲存精度：float32 為基準，float16 / int8 為 FAISS 純量量化（SQfp16 / SQ8）
+PRECISION_CONFIGS = [
+    {"index_type": "flat", "precision": "float32"},
+    {"index_type": "flat", "precision": "float16"},
+    {"index_type": "flat", "precision": "int8"},
+    {"index_type": "hnsw", "hnsw_m": 32, "ef_search": 64, "precision": "float16"},
+    {"index_type": "hnsw", "hnsw_m": 32, "ef_search": 64, "precision": "int8"},
+]
+
+def load_model(model_name=MODEL_NAME):
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModel.from_pretrained(model_name).eval()
+    return model, tokenizer
+
+def load_flattened_ontology(sememe_synonym_path=SEMEME_SYNONYM_PATH):
+    import check
+    with open(sememe_synonym_path, "r", encoding="utf-8") as f:
+        return check.flatten_sememe_data(json.load(f))
+
+def load_custom_corpus(synonym_path=CUSTOM_SYNONYM_PATH):
+    import build_vector_db as bvd
+    texts, ids, metas = bvd.collect_custom_augmented_texts(synonym_path, silent=True)
+    return texts, ids, metas
+
+# 多行程 CPU 編碼吞吐量（workers=1 為單行程基準）
+def benchmark_encode_workers(texts, model, tokenizer, worker_counts=(1, 2, 4, 8), pooling="cls", max_tokens=None):
+    device = torch.device("cpu")
+    results = []
+    for num_workers in worker_counts:
+        start = time.perf_counter()
+        vu.encode_texts(texts, model, tokenizer, device, pooling, max_tokens=max_tokens, num_workers=num_workers)
+        elapsed = time.perf_counter() - start
+        results.append({
+            "num_workers": num_workers,
+            "seconds": elapsed,
+            "texts_per_sec": len(texts) / elapsed,
+            "speedup": results[0]["seconds"] / elapsed if results else 1.0,
+        })
+        print(f"workers={num_workers}｜{elapsed:.2f}s｜{len(texts) / elapsed:.1f} texts/s｜x{results[-1]['speedup']:.2f}")
+    return results
+
+# 從已建好的 flat 索引取回全部向量
+def load_index_vectors(index_path):
+    index = faiss.read_index(index_path)
+    if isinstance(index, faiss.IndexIDMap):
+        index = faiss.downcast_index(index.index)
+    return index.reconstruct_n(0, index.ntotal)
+
+# recall@k：近似結果與 flat 精確結果的 top-k 交集比例
+def recall_at_k(exact_ids, approx_ids):
+    k = exact_ids.shape[1]
+    hits = sum(len(set(e[e >= 0]) & set(a[a >= 0])) for e, a in zip(exact_ids, approx_ids))
+    return hits / (len(exact_ids) * k)
+
+# 各索引類型的 recall@k、QPS 與索引記憶體（序列化大小）
+def benchmark_ann_indexes(vectors, queries, configs=ANN_CONFIGS, k=10):
+    exact = vu.build_faiss_index(vectors, index_type="flat")
+    exact_scores, exact_ids = exact.search(queries, k)
+    results = []
+    for config in configs:
+        config = dict(config)
+        nprobe = config.pop("nprobe", None)
+        ef_search = config.pop("ef_search", None)
+        start = time.perf_counter()
+        index = vu.build_faiss_index(vectors, **config)
+        build_seconds = time.perf_counter() - start
+        vu.set_search_params(index, nprobe=nprobe, ef_search=ef_search)
+
+        start = time.perf_counter()
+        approx_scores, approx_ids = index.search(queries, k)
+        search_seconds = time.perf_counter() - start
+
+        result = {
+            **config,
+            "nprobe": nprobe,
+            "ef_search": ef_search,
+            f"recall@{k}": recall_at_k(exact_ids, approx_ids),
+            "max_score_error": float(np.abs(approx_scores[:, 0] - exact_scores[:, 0]).max()) if len(queries) else 0.0,
+            "qps": len(queries) / search_seconds,
+            "memory_mb": faiss.serialize_index(index).nbytes / 2**20,
+            "build_seconds": build_seconds,
+        }
+        results.append(result)
+        print(
+            f"{config['index_type']:<9}｜{config.get('precision', 'float32'):<7}｜nprobe={nprobe}｜efSearch={ef_search}｜"
+            f"recall@{k}={result[f'recall@{k}']:.4f}｜QPS={result['qps']:.0f}｜"
+            f"{result['memory_mb']:.1f} MB｜建置 {build_seconds:.1f}s"
+        )
+    return results
+
+# 批次多查詢搜尋 vs. 逐筆呼叫單查詢函式
+def benchmark_batch_search(queries, index_list, model, tokenizer, device, topk=5):
+    indices = [pair[0] for pair in index_list]
+    metadatas = [pair[1] for pair in index_list]
+    cases = [
+        (
+            "search_with_metadata",
+            lambda: [vu.search_with_metadata(q, indices[0], metadatas[0], model, tokenizer, device, topk) for q in queries],
+            lambda: vu.batch_search_with_metadata(queries, indices[0], metadatas[0], model, tokenizer, device, topk),
+        ),
+        (
+            "combine_search",
+            lambda: [
+                vu.combine_search(q, indices=indices, metadatas=metadatas, model=model, tokenizer=tokenizer,
+                                  device=device, topk=topk)
+                for q in queries
+            ],
+            lambda: vu.batch_combine_search(queries, indices=indices, metadatas=metadatas, model=model,
+                                            tokenizer=tokenizer, device=device, topk=topk),
+        ),
+        (
+            "easy_search_all",
+            lambda: [vu.easy_search_all(q, index_list, model, tokenizer, device, topk) for q in queries],
+            lambda: vu.batch_easy_search_all(queries, index_list, model, tokenizer, device, topk),
+        ),
+    ]
+    results = []
+    for name, loop_fn, batch_fn in cases:
+        start = time.perf_counter()
+        loop_fn()
+        loop_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        batch_fn()
+        batch_seconds = time.perf_counter() - start
+        results.append({"function": name, "loop_seconds": loop_seconds, "batch_seconds": batch_seconds})
+        print(
+            f"{name:<21}｜逐筆 {len(queries) / loop_seconds:.1f} q/s｜批次 {len(queries) / batch_seconds:.1f} q/s｜"
+            f"x{loop_seconds / batch_seconds:.2f}"
+        )
+    return results
+
+# 以子行程量測冷啟動時間（每次都是全新的直譯器）
+def _time_subprocess(code, repeats=3):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", code], check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+# sememe_tools 啟動時間：舊流程（import 即載入 HowNet + 逐詞 add_word） vs. 延遲載入 + jieba 詞典快取
+def benchmark_sememe_startup(jieba_cache_path, repeats=3):
+    cases = [
+        ("import sememe_tools", "import sememe_tools"),
+        (
+            "HowNet + 逐詞注入（舊流程）",
+            "import sememe_tools as st; st.get_hownet(); st.inject_all_hownet_words()",
+        ),
+        (
+            "jieba 詞典快取",
+            f"import sememe_tools as st; st.inject_all_hownet_words(cache_path={jieba_cache_path!r})",
+        ),
+    ]
+    if not os.path.exists(jieba_cache_path):
+        _time_subprocess(cases[2][1], repeats=1)  # 第一次執行建立快取
+    results = []
+    for name, code in cases:
+        seconds = _time_subprocess(code, repeats)
+        results.append({"case": name, "seconds": seconds})
+        print(f"{name:<24}｜{seconds:.2f}s")
+    return results
+
+# 子行程內執行 code 後回報最大常駐記憶體（MB，Linux ru_maxrss 單位為 KB）
+def _subprocess_max_rss_mb(code):
+    probe = code + "; import resource; print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)"
+    output = subprocess.run(
+        [sys.executable, "-c", probe], check=True, capture_output=True, text=True,
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+    ).stdout
+    return int(output.strip().splitlines()[-1]) / 1024
+
+# 精簡義原詞典 vs. HowNetDict：每個服務行程的記憶體、單詞查詢延遲與結果一致性
+def benchmark_sememe_lexicon(lexicon_path, sentences, repeats=5):
+    import sememe_tools as st
+    if not os.path.exists(lexicon_path):
+        st.build_sememe_lexicon(lexicon_path, verbose=True)
+    rss = {
+        "HowNetDict": _subprocess_max_rss_mb("import sememe_tools as st; st.get_hownet()"),
+        "精簡詞典": _subprocess_max_rss_mb(f"import sememe_tools as st; st.load_sememe_lexicon({lexicon_path!r})"),
+    }
+    lexicon = st.SememeLexicon(lexicon_path)
+    words = [lexicon._word_at(row).decode("utf-8") for row in range(0, len(lexicon), max(1, len(lexicon) // 10000))]
+    hownet_dict = st.get_hownet()
+    lookups = {
+        "HowNetDict": lambda word: st._first_sense_sememes(hownet_dict.get_sense(word)),
+        "精簡詞典": lexicon.get,
+    }
+    results = []
+    for name, lookup in lookups.items():
+        best = float("inf")
+        for _ in range(repeats):
+            start = time.perf_counter()
+            for word in words:
+                lookup(word)
+            best = min(best, time.perf_counter() - start)
+        results.append({"backend": name, "rss_mb": rss[name], "lookup_us": best / len(words) * 1e6})
+        print(f"{name:<12}｜RSS {rss[name]:.0f} MB｜單詞查詢 {best / len(words) * 1e6:.2f} µs")
+    mismatches = st.compare_lexicon_with_hownet(lexicon, sentences=sentences)
+    print(f"一致性檢查：{len(lexicon)} 個詞、{len(sentences)} 句，不一致 {len(mismatches)} 筆")
+    return results, mismatches
+
+# 舊版正規化：逐一對照表項目呼叫 str.replace（結果取決於字典順序）
+def _legacy_normalize_text(text, mapping):
+    for simp, trad in mapping.items():
+        text = text.replace(simp, trad)
+    return re.sub(r"\s+", "", text).lower()
+
+# build_precise_maps 會正規化的字串：詞、同義詞與分類線索
+def _ontology_texts(flattened_data):
+    texts = []
+    for key, entry in flattened_data.items():
+        zh_entry = entry.get("zh", key)
+        texts += zh_entry if isinstance(zh_entry, list) else [zh_entry]
+        texts += entry.get("synonyms", [])
+        texts += entry.get("tags", [])
+        texts += entry.get("categories", [])
+    return [text for text in texts if isinstance(text, str) and text]
+
+# SimpleNormalizer：逐項 str.replace vs. 最長匹配單次掃描
+def benchmark_normalizer(flattened_data, repeats=5):
+    import check
+    texts = _ontology_texts(flattened_data)
+    mapping = check.SimpleNormalizer.TRAD_MAPPING
+    cases = [
+        ("逐項 str.replace", lambda text: _legacy_normalize_text(text, mapping)),
+        ("最長匹配單次掃描", check.SimpleNormalizer.normalize_text),
+    ]
+    results = []
+    for name, normalize in cases:
+        best = float("inf")
+        for _ in range(repeats):
+            start = time.perf_counter()
+            for text in texts:
+                normalize(text)
+            best = min(best, time.perf_counter() - start)
+        results.append({"case": name, "seconds": best, "us_per_text": best / len(texts) * 1e6})
+        print(f"{name:<16}｜{len(texts)} 筆｜{best * 1000:.1f} ms｜{best / len(texts) * 1e6:.2f} µs/筆")
+    changed = [(text, cases[0][1](text), cases[1][1](text)) for text in texts if cases[0][1](text) != cases[1][1](text)]
+    print(f"與舊版結果不同：{len(changed)} 筆｜例：{changed[:5]}")
+    return results, changed
+
+# 舊版天氣再分類：逐詞掃描所有分類找原分類，再逐一比對 WEATHER_OVERRIDE 子字串
+def _legacy_reclassify_weather_terms(category_term_sets, classified_terms):
+    import check
+    reclassified_terms = []
+    for word in list(classified_terms):
+        original = None
+        for cat, terms in category_term_sets.items():
+            if word in terms:
+                original = cat
+                break
+        if any(keyword in word for keyword in check.WEATHER_OVERRIDE):
+            if word not in check.CLIMATE_EXCLUDE_FROM_WEATHER and original != "weather":
+                if original:
+                    category_term_sets[original].remove(word)
+                category_term_sets["weather"].add(word)
+                reclassified_terms.append((word, original, "weather"))
+    return reclassified_terms
+
+# build_precise_maps 各步驟耗時，並驗證天氣再分類結果與舊版逐詞掃描完全相同
+def benchmark_precise_maps(sememe_synonym_path=SEMEME_SYNONYM_PATH):
+    import check
+    flattened_data = load_flattened_ontology(sememe_synonym_path)
+    start = time.perf_counter()
+    _, category_term_sets, classified_terms, _, word_categories = check.classify_entries(flattened_data)
+    classify_seconds = time.perf_counter() - start
+
+    legacy_sets = copy.deepcopy(category_term_sets)
+    start = time.perf_counter()
+    legacy_terms = _legacy_reclassify_weather_terms(legacy_sets, classified_terms)
+    legacy_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    reclassified_terms = check.reclassify_weather_terms(category_term_sets, classified_terms, word_categories)
+    reclassify_seconds = time.perf_counter() - start
+
+    identical = reclassified_terms == legacy_terms and dict(category_term_sets) == dict(legacy_sets)
+    print(f"詞條分類｜{len(flattened_data)} 筆｜{classify_seconds * 1000:.1f} ms")
+    print(f"天氣再分類｜舊版 {legacy_seconds * 1000:.2f} ms｜反向表 {reclassify_seconds * 1000:.2f} ms")
+    print(f"reclassified_terms：{len(reclassified_terms)} 筆｜與舊版相同：{identical}")
+    if not identical:
+        raise AssertionError("天氣再分類結果與舊版不同")
+    return {
+        "classify_seconds": classify_seconds,
+        "legacy_reclassify_seconds": legacy_seconds,
+        "reclassify_seconds": reclassify_seconds,
+        "reclassified_terms": reclassified_terms,
+    }
+
+# 壓平 + build_precise_maps 的耗時與 Python 配置峰值：整份載入（含 raw、縮排輸出） vs. 串流 JSONL
+def benchmark_flatten(sememe_synonym_path=SEMEME_SYNONYM_PATH, output_dir="/tmp"):
+    import tracemalloc
+    import check
+
+    def in_memory():
+        with open(sememe_synonym_path, "r", encoding="utf-8") as f:
+            flattened_data = check.flatten_sememe_data(json.load(f))
+        check.build_precise_maps(flattened_data)
+        output_path = os.path.join(output_dir, "flattened_sememe_synonym.json")
+        with open(output_path, "w", encoding="utf-8") as f:
+            json.dump(flattened_data, f, ensure_ascii=False, indent=2)
+        return output_path
+
+    def streaming():
+        output_path = os.path.join(output_dir, "flattened_sememe_synonym.jsonl")
+        check.build_precise_maps_streaming(sememe_synonym_path, output_path)
+        return output_path
+
+    results = []
+    for name, run in (("整份載入", in_memory), ("串流 JSONL", streaming)):
+        tracemalloc.start()
+        start = time.perf_counter()
+        output_path = run()
+        seconds = time.perf_counter() - start
+        peak_mb = tracemalloc.get_traced_memory()[1] / 2**20
+        tracemalloc.stop()
+        size_mb = os.path.getsize(output_path) / 2**20
+        results.append({"case": name, "seconds": seconds, "peak_mb": peak_mb, "output_mb": size_mb})
+        print(f"{name:<10}｜{seconds:.2f}s｜峰值 {peak_mb:.1f} MB｜輸出 {size_mb:.2f} MB")
+    return results
+
+# 每個建置 / 服務行程的本體初始化：重新壓平 + 分類 + 產生待嵌入文字 vs. 載入編譯檔
+def benchmark_ontology_artifact(sememe_synonym_path=SEMEME_SYNONYM_PATH, artifact_path="/tmp/ontology.bin", repeats=3):
+    import check
+    import sememe_tools as st
+
+    def rederive():
+        with open(sememe_synonym_path, "r", encoding="utf-8") as f:
+            flattened_data = check.flatten_sememe_data(json.load(f))
+        custom_synonym_map = check.build_precise_maps(flattened_data)[0]
+        st.set_custom_synonym_map(custom_synonym_map)
+        st.set_custom_synonyms(flattened_data)
+        return check.collect_embedding_texts(flattened_data)
+
+    check.compile_ontology_artifact(load_flattened_ontology(sememe_synonym_path), artifact_path)
+    cases = [("重新推導", rederive), ("載入編譯檔", lambda: st.load_custom_ontology(artifact_path)["embedding"])]
+    results = []
+    for name, run in cases:
+        best = float("inf")
+        for _ in range(repeats):
+            start = time.perf_counter()
+            run()
+            best = min(best, time.perf_counter() - start)
+        results.append({"case": name, "seconds": best})
+        print(f"{name:<8}｜{best * 1000:.1f} ms")
+    print(f"編譯檔大小：{os.path.getsize(artifact_path) / 2**20:.2f} MB")
+    return results
+
+def run_encode_workers():
+    model, tokenizer = load_model()
+    texts, _, _ = load_custom_corpus()
+    print(f"自製同義詞語料：{len(texts)} 筆")
+    benchmark_encode_workers(texts, model, tokenizer)
+
+def run_ann_indexes(num_queries=1000, seed=0):
+    for name, index_path in (("NLPCC-MH", NLPCC_INDEX_PATH), ("自製同義詞", CUSTOM_INDEX_PATH)):
+        vectors = load_index_vectors(index_path)
+        rng = np.random.default_rng(seed)
+        queries = vectors[rng.choice(len(vectors), min(num_queries, len(vectors)), replace=False)]
+        print(f"\n{name}：{len(vectors)} 筆向量、{len(queries)} 筆查詢")
+        benchmark_ann_indexes(vectors, queries)
+
+def run_precision(num_queries=1000, seed=0):
+    for name, index_path in (("NLPCC-MH", NLPCC_INDEX_PATH), ("自製同義詞", CUSTOM_INDEX_PATH)):
+        vectors = load_index_vectors(index_path)
+        rng = np.random.default_rng(seed)
+        queries = vectors[rng.choice(len(vectors), min(num_queries, len(vectors)), replace=False)]
+        print(f"\n{name}：{len(vectors)} 筆向量、{len(queries)} 筆查詢")
+        benchmark_ann_indexes(vectors, queries, configs=PRECISION_CONFIGS)
+
+def run_batch_search(num_queries=256, seed=0):
+    model, tokenizer = load_model()
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    model = model.to(device)
+    index_list = [
+        vu.load_index_and_metadata(NLPCC_INDEX_PATH, NLPCC_META_PATH),
+        vu.load_index_and_metadata(CUSTOM_INDEX_PATH, CUSTOM_META_PATH),
+    ]
+    metadata = index_list[0][1]
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(len(metadata), min(num_queries, len(metadata)), replace=False)
+    queries = [metadata[int(row)]["meta"].get("query", metadata[int(row)]["text"]) for row in rows]
+    print(f"{len(queries)} 筆查詢，{len(index_list)} 個索引")
+    benchmark_batch_search(queries, index_list, model, tokenizer, device)
+
+def run_sememe_startup():
+    benchmark_sememe_startup("/content/jieba_hownet.cache")
+
+def run_sememe_lexicon(num_sentences=1000, seed=0):
+    metadata = vu.load_index_and_metadata(NLPCC_INDEX_PATH, NLPCC_META_PATH)[1]
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(len(metadata), min(num_sentences, len(metadata)), replace=False)
+    sentences = [metadata[int(row)]["meta"].get("query", metadata[int(row)]["text"]) for row in rows]
+    benchmark_sememe_lexicon("/content/sememe_lexicon.bin", sentences)
+
+def run_normalizer():
+    benchmark_normalizer(load_flattened_ontology())
+
+BENCHMARKS = {
+    "encode_workers": run_encode_workers,
+    "ann_indexes": run_ann_indexes,
+    "batch_search": run_batch_search,
+    "precision": run_precision,
+    "sememe_startup": run_sememe_startup,
+    "sememe_lexicon": run_sememe_lexicon,
+    "normalizer": run_normalizer,
+    "precise_maps": benchmark_precise_maps,
+    "flatten": benchmark_flatten,
+    "ontology_artifact": benchmark_ontology_artifact,
+}
+
+if __name__ == "__main__":
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        print(f"\n==== {name} ====")
+        BENCHMARKS[name]()
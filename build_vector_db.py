@@ -2,27 +2,35 @@
 
 import os
 import json
+import time
+import queue
+import shutil
+import threading
 from tqdm import tqdm
 import torch
 from transformers import AutoTokenizer, AutoModel
+import check
 import sememe_tools as st
 import vector_utils_advanced as vu
 
-# 處理 NLPCC-MH 資料並建置向量庫
-def prepare_nlpccmh_augmented_data(
-    input_path, index_path, meta_path, model, tokenizer, device, pooling="cls", silent=False
-):
+# 讀取 NLPCC-MH 語義標註資料，產生待編碼文字
+def collect_nlpccmh_augmented_texts(input_path, silent=False):
     assert os.path.exists(input_path), f"找不到輸入檔案: {input_path}"
 
     texts, ids, metas = [], [], []
+    formatted = {}  # 同一問句的多個三元組只格式化一次
     with open(input_path, "r", encoding="utf-8") as f:
         for i, line in enumerate(tqdm(f, desc="處理 NLPCC-MH 資料", disable=silent)):
             entry = json.loads(line.strip())
             question = entry["question"]
             sememe_map = entry["question_sememe_map"]
 
-            pseudo_text = "；".join(st.format_sememe_map(sememe_map, style="display"))
-            merged_query = st.generate_augmented_query(question, sememe_map)
+            if question not in formatted:
+                formatted[question] = (
+                    "；".join(st.format_sememe_map(sememe_map, style="display")),
+                    st.generate_augmented_query(question, sememe_map)
+                )
+            pseudo_text, merged_query = formatted[question]
 
             texts.append(merged_query)
             ids.append(entry["id"])
@@ -30,6 +38,48 @@ def prepare_nlpccmh_augmented_data(
                 "query": question,
                 "sememe": pseudo_text
             })
+    return texts, ids, metas
+
+# 讀取去重中介格式（問句表 + 三元組表）：每個問句只組一次增強文字，三元組共用同一份文字與 meta
+def collect_nlpccmh_table_texts(questions_path, triples_path, silent=False):
+    assert os.path.exists(questions_path), f"找不到輸入檔案: {questions_path}"
+    assert os.path.exists(triples_path), f"找不到輸入檔案: {triples_path}"
+
+    questions = {}
+    with open(questions_path, "r", encoding="utf-8") as f:
+        for line in tqdm(f, desc="處理 NLPCC-MH 問句表", disable=silent):
+            entry = json.loads(line.strip())
+            question = entry["question"]
+            sememe_map = entry["question_sememe_map"]
+            questions[entry["qid"]] = (
+                st.generate_augmented_query(question, sememe_map),
+                {
+                    "query": question,
+                    "sememe": "；".join(st.format_sememe_map(sememe_map, style="display"))
+                }
+            )
+
+    texts, ids, metas = [], [], []
+    with open(triples_path, "r", encoding="utf-8") as f:
+        for line in tqdm(f, desc="處理 NLPCC-MH 三元組表", disable=silent):
+            entry = json.loads(line.strip())
+            merged_query, meta = questions[entry["qid"]]
+            texts.append(merged_query)
+            ids.append(entry["id"])
+            metas.append(meta)
+    return texts, ids, metas
+
+# 處理 NLPCC-MH 資料並建置向量庫
+# triples_path 不為 None 時，input_path 視為問句表（去重中介格式）
+# 相同增強文字只編碼一次（deduplicate），各三元組 id 對應到同一向量
+def prepare_nlpccmh_augmented_data(
+    input_path, index_path, meta_path, model, tokenizer, device, pooling="cls", silent=False, max_tokens=None,
+    num_workers=1, cache=None, incremental=False, index_type="flat", triples_path=None, precision="float32"
+):
+    if triples_path:
+        texts, ids, metas = collect_nlpccmh_table_texts(input_path, triples_path, silent=silent)
+    else:
+        texts, ids, metas = collect_nlpccmh_augmented_texts(input_path, silent=silent)
 
     vu.build_faiss_index_and_save(
         texts=texts,
@@ -40,59 +90,35 @@ def prepare_nlpccmh_augmented_data(
         device=device,
         index_path=index_path,
         meta_path=meta_path,
-        pooling=pooling
+        pooling=pooling,
+        max_tokens=max_tokens,
+        num_workers=num_workers,
+        cache=cache,
+        incremental=incremental,
+        index_type=index_type,
+        deduplicate=True,
+        precision=precision
     )
     if not silent:
         print(f"NLPCC-MH 向量庫已建置完成，共 {len(texts)} 筆資料。")
 
+# 讀取自製同義詞資料，產生待編碼文字：本體編譯檔（check.py 產生）直接取用，否則由壓平輸出重新計算
+def collect_custom_augmented_texts(synonym_path, silent=False):
+    assert os.path.exists(synonym_path), f"找不到輸入檔案: {synonym_path}"
+
+    if st.is_ontology_artifact(synonym_path):
+        embedding = st.load_ontology_artifact(synonym_path)["embedding"]
+        return embedding["texts"], embedding["ids"], embedding["metas"]
+
+    synonym_entries = check.iter_flattened_file(synonym_path)  # 壓平輸出：.json 或逐行 .jsonl
+    return check.collect_embedding_texts(tqdm(synonym_entries, desc="處理自製同義詞資料", disable=silent))
+
 # 處理自製同義詞資料，建立向量庫
 def prepare_custom_augmented_data(
-    synonym_path, index_path, meta_path, model, tokenizer, device, pooling="cls", silent=False
+    synonym_path, index_path, meta_path, model, tokenizer, device, pooling="cls", silent=False, max_tokens=None,
+    num_workers=1, cache=None, incremental=False, index_type="flat", precision="float32"
 ):
-    assert os.path.exists(synonym_path), f"找不到輸入檔案: {synonym_path}"
-
-    texts, ids, metas = [], [], []
-    with open(synonym_path, "r", encoding="utf-8") as f:
-        synonym_data = json.load(f)
-
-    for i, (key, entry) in enumerate(tqdm(synonym_data.items(), desc="處理自製同義詞資料", disable=silent)):
-        zh_entry = entry.get("zh", key)
-        synonyms = entry.get("synonyms", [])
-        categories = entry.get("categories", {})
-
-        if isinstance(zh_entry, list):
-            standard_word = zh_entry[0]
-            parts = zh_entry.copy()
-        else:
-            standard_word = zh_entry
-            parts = [zh_entry]
-
-        parts.extend(synonyms)
-        parts = list(set(filter(None, parts)))  # 去重與清理
-
-        description = "、".join(parts) + "。這些是相關語義擴展資訊。"
-        merged = f"[Q] {standard_word} [SEP] {description}"
-
-        texts.append(merged)
-        ids.append(f"custom_{i}")
-        metas.append({
-            "term": standard_word,
-            "synonyms": synonyms,
-            "categories": categories,
-            "is_location": False
-        })
-
-        # 增補地區向量（僅限分類為 location）
-        if isinstance(entry.get("classification"), list) and "location" in entry["classification"]:
-            for loc_term in parts:
-                texts.append(f"[Q] {loc_term} [SEP] {standard_word}地區")
-                ids.append(f"city_{i}_{loc_term}")
-                metas.append({
-                    "term": loc_term,
-                    "synonyms": [],
-                    "categories": {"location": True},
-                    "is_location": True
-                })
+    texts, ids, metas = collect_custom_augmented_texts(synonym_path, silent=silent)
 
     vu.build_faiss_index_and_save(
         texts=texts,
@@ -103,12 +129,84 @@ def prepare_custom_augmented_data(
         device=device,
         index_path=index_path,
         meta_path=meta_path,
-        pooling=pooling
+        pooling=pooling,
+        max_tokens=max_tokens,
+        num_workers=num_workers,
+        cache=cache,
+        incremental=incremental,
+        index_type=index_type,
+        precision=precision
     )
     if not silent:
         print(f"自製 Synonym 向量庫已建置完成，共 {len(texts)} 筆資料。")
 
+# 單一向量庫的編碼與建索引；checkpoint_dir 不為 None 時分塊編碼並保存區塊，可中斷續跑
+def _build_store(
+    name, texts, ids, metas, index_path, meta_path, model, tokenizer, device, timings, silent=False, max_tokens=None,
+    num_workers=1, cache=None, incremental=False, index_type="flat", deduplicate=False, checkpoint_dir=None,
+    chunk_size=4096, streaming=False, precision="float32"
+):
+    build_kwargs = dict(
+        texts=texts,
+        ids=ids,
+        meta_list=metas,
+        model=model,
+        tokenizer=tokenizer,
+        device=device,
+        index_path=index_path,
+        meta_path=meta_path,
+        max_tokens=max_tokens,
+        num_workers=num_workers,
+        cache=cache,
+        incremental=incremental,
+        index_type=index_type,
+        deduplicate=deduplicate,
+        precision=precision
+    )
+    if streaming:
+        start = time.perf_counter()
+        vu.build_faiss_index_and_save(**build_kwargs, streaming=True, silent=silent)
+        timings[f"{name}:encode+index"] = time.perf_counter() - start
+        return
+    if not checkpoint_dir:
+        start = time.perf_counter()
+        vu.build_faiss_index_and_save(**build_kwargs)
+        timings[f"{name}:encode+index"] = time.perf_counter() - start
+        return
+
+    stage_dir = os.path.join(checkpoint_dir, name)
+    done_path = os.path.join(stage_dir, "done.json")
+    manifest = vu.encode_checkpoint_manifest(texts, model, max_tokens=max_tokens, chunk_size=chunk_size,
+                                             deduplicate=deduplicate)
+    done = {
+        "manifest": manifest, "index_path": index_path, "meta_path": meta_path, "index_type": index_type,
+        "precision": precision,
+    }
+    if os.path.exists(done_path) and os.path.exists(index_path) and os.path.exists(meta_path):
+        with open(done_path, "r", encoding="utf-8") as f:
+            if json.load(f) == done:
+                if not silent:
+                    print(f"{name} 已於先前執行完成，略過")
+                return
+
+    start = time.perf_counter()
+    build_kwargs["vectors"] = vu.encode_texts_checkpointed(
+        texts, model, tokenizer, device, stage_dir, chunk_size=chunk_size, max_tokens=max_tokens,
+        num_workers=num_workers, cache=cache, deduplicate=deduplicate, silent=silent,
+    )
+    timings[f"{name}:encode"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    vu.build_faiss_index_and_save(**build_kwargs)
+    timings[f"{name}:index"] = time.perf_counter() - start
+    with open(done_path, "w", encoding="utf-8") as f:
+        json.dump(done, f, ensure_ascii=False)
+
 # 執行全部向量庫建立
+# 文字準備在背景執行緒進行，經有界佇列交給主執行緒編碼：下一個向量庫的準備與目前的編碼重疊。
+# checkpoint_dir 不為 None 時各向量庫分塊保存已編碼的列範圍，中斷後以相同參數重跑會從最後完成的區塊續跑
+# （與 incremental 互斥）；全部完成後除非 keep_checkpoints=True 否則清除。
+# streaming=True 時逐視窗編碼、正規化並加入索引，不保留整份向量矩陣。回傳各階段耗時（秒）
 def run_all_indexing(
     nlpcc_input_path,
     nlpcc_index_path,
@@ -119,37 +217,99 @@ def run_all_indexing(
     model,
     tokenizer,
     device,
-    silent=False
+    silent=False,
+    max_tokens=None,
+    num_workers=1,
+    cache_dir=None,
+    incremental=False,
+    nlpcc_index_type="flat",
+    custom_index_type="flat",
+    nlpcc_precision="float32",
+    custom_precision="float32",
+    nlpcc_triples_path=None,
+    checkpoint_dir=None,
+    chunk_size=4096,
+    keep_checkpoints=False,
+    streaming=False
 ):
+    if checkpoint_dir and incremental:
+        raise ValueError("checkpoint_dir 與 incremental 不能同時使用")
+    if streaming and (checkpoint_dir or incremental or cache_dir):
+        raise ValueError("streaming 不能與 checkpoint_dir / incremental / cache_dir 同時使用")
     if not silent:
         print("開始全流程向量庫建立...")
 
-    print("\n開始建立 NLPCC-MH 向量庫...")
-    prepare_nlpccmh_augmented_data(
-        input_path=nlpcc_input_path,
-        index_path=nlpcc_index_path,
-        meta_path=nlpcc_meta_path,
-        model=model,
-        tokenizer=tokenizer,
-        device=device,
-        silent=silent
-    )
+    # 兩個向量庫共用同一份磁碟向量快取，僅重新編碼有變動的文字
+    cache = vu.EmbeddingCache(cache_dir) if cache_dir else None
 
-    print("\n開始建立自製 Synonym 向量庫...")
-    prepare_custom_augmented_data(
-        synonym_path=synonym_path,
-        index_path=custom_index_path,
-        meta_path=custom_meta_path,
-        model=model,
-        tokenizer=tokenizer,
-        device=device,
-        silent=silent
-    )
+    def collect_nlpcc():
+        if nlpcc_triples_path:
+            return collect_nlpccmh_table_texts(nlpcc_input_path, nlpcc_triples_path, silent=silent)
+        return collect_nlpccmh_augmented_texts(nlpcc_input_path, silent=silent)
+
+    stages = [
+        ("nlpcc", "NLPCC-MH", collect_nlpcc, dict(
+            index_path=nlpcc_index_path, meta_path=nlpcc_meta_path, index_type=nlpcc_index_type, deduplicate=True,
+            precision=nlpcc_precision
+        )),
+        ("custom", "自製 Synonym", lambda: collect_custom_augmented_texts(synonym_path, silent=silent), dict(
+            index_path=custom_index_path, meta_path=custom_meta_path, index_type=custom_index_type,
+            precision=custom_precision
+        )),
+    ]
+    timings = {}
+    prepared = queue.Queue(maxsize=1)
 
+    def producer():
+        for name, _, collect, _ in stages:
+            start = time.perf_counter()
+            try:
+                result = collect()
+            except BaseException as e:
+                prepared.put((name, e))
+                return
+            timings[f"{name}:prepare"] = time.perf_counter() - start
+            prepared.put((name, result))
+
+    wall_start = time.perf_counter()
+    threading.Thread(target=producer, name="prepare-texts", daemon=True).start()
+    for name, label, _, store_kwargs in stages:
+        _, result = prepared.get()
+        if isinstance(result, BaseException):
+            raise result
+        texts, ids, metas = result
+        print(f"\n開始建立 {label} 向量庫...")
+        _build_store(
+            name, texts, ids, metas, model=model, tokenizer=tokenizer, device=device, timings=timings, silent=silent,
+            max_tokens=max_tokens, num_workers=num_workers, cache=cache, incremental=incremental,
+            checkpoint_dir=checkpoint_dir, chunk_size=chunk_size, streaming=streaming, **store_kwargs
+        )
+        if not silent:
+            print(f"{label} 向量庫已建置完成，共 {len(texts)} 筆資料。")
+    timings["total"] = time.perf_counter() - wall_start
+
+    if cache is not None and not silent:
+        print(f"向量快取命中 {cache.hits} 筆、未命中 {cache.misses} 筆")
+    if checkpoint_dir and not keep_checkpoints:
+        shutil.rmtree(checkpoint_dir, ignore_errors=True)
+    if not silent:
+        print("\n各階段耗時：")
+        for stage, seconds in timings.items():
+            print(f"  {stage:<20}{seconds:.2f}s")
     print("\n全部向量庫建立完成！")
+    return timings
 
 # ---- 執行模型初始化與 run_all_indexing ----
 if __name__ == "__main__":
+    import argparse
+
+    # 預設為完整重建；增量更新、向量快取與長度分桶需明確指定
+    parser = argparse.ArgumentParser(description="建立 NLPCC-MH 與自製同義詞向量庫")
+    parser.add_argument("--incremental", action="store_true", help="只重新編碼新增或變動的資料（需既有索引）")
+    parser.add_argument("--cache-dir", default=None, help="磁碟向量快取目錄，例如 /content/embedding_cache")
+    parser.add_argument("--max-tokens", type=int, default=None, help="長度分桶模式每批 token 上限，例如 16384")
+    args = parser.parse_args()
+
     device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
     tokenizer = AutoTokenizer.from_pretrained("BAAI/bge-base-zh")
     hf_model = AutoModel.from_pretrained("BAAI/bge-base-zh").to(device).eval()
@@ -158,10 +318,13 @@ if __name__ == "__main__":
         nlpcc_input_path="/content/NLPCC-MH/data/nlpcc-mh.train_sememe.jsonl",
         nlpcc_index_path="/content/index.faiss",
         nlpcc_meta_path="/content/metadata.jsonl",
-        synonym_path="/content/Weather-AI-Agent/flattened_sememe_synonym.json",
+        synonym_path="/content/Weather-AI-Agent/ontology.bin",
         custom_index_path="/content/custom_index.faiss",
         custom_meta_path="/content/custom_metadata.jsonl",
         model=hf_model,
         tokenizer=tokenizer,
-        device=device
+        device=device,
+        max_tokens=args.max_tokens,
+        cache_dir=args.cache_dir,
+        incremental=args.incremental
     )
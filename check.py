@@ -5,6 +5,89 @@ import json
 import sememe_tools as st_module
 from collections import defaultdict
 
+# 字典樹：每個節點為 {字元: 子節點}，詞尾節點以 None 為鍵存放對應值
+def _build_trie(mapping):
+    trie = {}
+    for key, value in mapping.items():
+        if not key:
+            continue
+        node = trie
+        for char in key:
+            node = node.setdefault(char, {})
+        node[None] = value
+    return trie
+
+# 最長匹配替換器：由對照表建立字典樹，由左至右單次掃描，每個位置取最長的匹配詞替換
+# （結果與對照表順序無關，例如「台风」整詞替換為「颱風」，不會先被「风」拆開）
+class LongestMatchReplacer:
+    def __init__(self, mapping):
+        self.trie = _build_trie(mapping)
+
+    def replace(self, text):
+        trie = self.trie
+        pieces = []
+        i, n = 0, len(text)
+        while i < n:
+            node = trie.get(text[i])
+            if node is None:
+                pieces.append(text[i])
+                i += 1
+                continue
+            match, match_end = None, i
+            j = i + 1
+            while True:
+                if None in node:
+                    match, match_end = node[None], j
+                if j >= n:
+                    break
+                node = node.get(text[j])
+                if node is None:
+                    break
+                j += 1
+            if match is None:
+                pieces.append(text[i])
+                i += 1
+            else:
+                pieces.append(match)
+                i = match_end
+        return "".join(pieces)
+
+# 前綴分類器：回傳 key 最長的匹配前綴所對應的值，查詢為 O(len(key))，與字典順序無關
+class PrefixTrie:
+    def __init__(self, mapping):
+        self.trie = _build_trie(mapping)
+
+    def longest(self, key):
+        node = self.trie
+        match = None
+        for char in key:
+            node = node.get(char)
+            if node is None:
+                break
+            if None in node:
+                match = node[None]
+        return match
+
+# 多關鍵詞比對器：單次掃描找出文字中出現的所有關鍵詞，回傳其對應值的集合
+class KeywordMatcher:
+    def __init__(self, mapping):
+        self.trie = _build_trie(mapping)
+
+    def labels(self, text):
+        trie = self.trie
+        found = set()
+        n = len(text)
+        for i in range(n):
+            node = trie
+            # 以索引走訪，不切出 text[i:] 副本；每個起點只前進到字典樹分支結束為止
+            for j in range(i, n):
+                node = node.get(text[j])
+                if node is None:
+                    break
+                if None in node:
+                    found.add(node[None])
+        return found
+
 # 正規化工具
 class SimpleNormalizer:
     # 常見簡體／混用字 ➜ 標準繁體字對應表
@@ -417,15 +500,15 @@ class SimpleNormalizer:
     "钱": "錢",
     "岁": "歲"
     }
+    REPLACER = LongestMatchReplacer(TRAD_MAPPING)
 
     @staticmethod
     def normalize_text(text):
         if not isinstance(text, str):
             text = str(text)
 
-        # 替換常見簡體字或異體字為繁體標準
-        for simp, trad in SimpleNormalizer.TRAD_MAPPING.items():
-            text = text.replace(simp, trad)
+        # 替換常見簡體字或異體字為繁體標準（單次掃描、最長匹配優先）
+        text = SimpleNormalizer.REPLACER.replace(text)
 
         # 移除空白與轉小寫
         return re.sub(r"\s+", "", text).lower()
@@ -435,60 +518,204 @@ class SimpleNormalizer:
 st = SimpleNormalizer()
 
 # 巢狀 json 壓平（保留路徑、語意、相關欄位）
-def flatten_sememe_data(data, path=None, results=None):
+NODE_KEYS = ("items", "categories", "subcategories")
+
+# 單一 item ➜ (key, 扁平詞條)；path 為共用的 tuple，keep_raw=False 時不保留原始 item
+def _flatten_item(item, path, keep_raw=True):
+    key = item.get("id") or item.get("zh") or item.get("en")
+    if not key:
+        return None
+    linked = item.get("linked_sememe", {})
+    zh_syns = linked.get("zh", []) if isinstance(linked, dict) else []
+    en_syns = linked.get("en", []) if isinstance(linked, dict) else []
+    zh_syns = zh_syns if isinstance(zh_syns, list) else [zh_syns]
+    en_syns = en_syns if isinstance(en_syns, list) else [en_syns]
+    synonyms = list(dict.fromkeys(filter(None, zh_syns + en_syns + item.get("synonyms", []))))  # 去重並保留原順序
+    zh_main = item.get("zh") or (zh_syns[0] if zh_syns else "")
+    entry = {
+        "id": item.get("id", ""),
+        "zh": zh_main,
+        "en": item.get("en", ""),
+        "synonyms": synonyms,
+        "categories": path,
+        "related_items": item.get("related_items", []),
+        "linked_sememe": item.get("linked_sememe", {}),
+        "tags": item.get("tags", []),
+        "concepts": item.get("concepts", {}),
+    }
+    if keep_raw:
+        entry["raw"] = item   # 保留原始資料
+    return key, entry
+
+# 以明確堆疊走訪（不遞迴），輸出順序與原遞迴版相同：
+#   每個節點先處理 items，再依序下探 categories、subcategories 與其他含 items/categories/subcategories 的子結構
+def flatten_sememe_data(data, path=None, results=None, keep_raw=True):
     if results is None:
         results = {}
-    if path is None:
-        path = []
-    if not isinstance(data, dict):
-        return results
-
-    # 處理 items
-    if "items" in data and isinstance(data["items"], list):
-        for item in data["items"]:
-            if not isinstance(item, dict):
-                continue
-            key = item.get("id") or item.get("zh") or item.get("en")
-            if not key:
-                continue
-            linked = item.get("linked_sememe", {})
-            zh_syns = linked.get("zh", []) if isinstance(linked, dict) else []
-            en_syns = linked.get("en", []) if isinstance(linked, dict) else []
-            zh_syns = zh_syns if isinstance(zh_syns, list) else [zh_syns]
-            en_syns = en_syns if isinstance(en_syns, list) else [en_syns]
-            synonyms = list(set(filter(None, zh_syns + en_syns + item.get("synonyms", []))))
-            zh_main = item.get("zh") or (zh_syns[0] if zh_syns else "")
-            results[key] = {
-                "id": item.get("id", ""),
-                "zh": zh_main,
-                "en": item.get("en", ""),
-                "synonyms": synonyms,
-                "categories": path.copy(),
-                "related_items": item.get("related_items", []),
-                "linked_sememe": item.get("linked_sememe", {}),
-                "tags": item.get("tags", []),
-                "concepts": item.get("concepts", {}),
-                "raw": item   # 保留原始資料
-            }
-
-    # 下探 categories
-    if "categories" in data and isinstance(data["categories"], dict):
-        for cat_name, cat_data in data["categories"].items():
-            flatten_sememe_data(cat_data, path + [cat_name], results)
-
-    # 下探 subcategories
-    if "subcategories" in data and isinstance(data["subcategories"], dict):
-        for subcat_name, subcat_data in data["subcategories"].items():
-            flatten_sememe_data(subcat_data, path + [subcat_name], results)
-
-    # 泛化：還有其他自定義巢狀結構就自動下探
-    for key, value in data.items():
-        if key not in {"items", "categories", "subcategories"}:
-            if isinstance(value, dict):
-                if any(k in value for k in ("items", "categories", "subcategories")):
-                    flatten_sememe_data(value, path + [key], results)
+    stack = [(data, tuple(path or ()))]
+    while stack:
+        node, node_path = stack.pop()
+        if not isinstance(node, dict):
+            continue
+
+        # 處理 items
+        if "items" in node and isinstance(node["items"], list):
+            for item in node["items"]:
+                if isinstance(item, dict):
+                    flattened = _flatten_item(item, node_path, keep_raw)
+                    if flattened:
+                        results[flattened[0]] = flattened[1]
+
+        children = []
+        # 下探 categories / subcategories
+        for child_key in ("categories", "subcategories"):
+            if child_key in node and isinstance(node[child_key], dict):
+                children.extend((child, node_path + (name,)) for name, child in node[child_key].items())
+        # 泛化：還有其他自定義巢狀結構就自動下探
+        for key, value in node.items():
+            if key not in NODE_KEYS and isinstance(value, dict) and any(k in value for k in NODE_KEYS):
+                children.append((value, node_path + (key,)))
+        stack.extend(reversed(children))
     return results
-    
+
+# ---- 串流壓平 ----
+# 事件格式同 ijson.parse：(prefix, event, value)，event 為 start_map / map_key / end_map /
+# start_array / end_array / 純量；只有 items 內的單一 item 會在記憶體中組成完整物件
+def iter_json_events(input_path):
+    import ijson  # 選用套件，僅串流模式需要
+    with open(input_path, "rb") as f:
+        yield from ijson.parse(f, use_float=True)
+
+# 略過目前值（first_event 為該值的第一個事件）
+def _skip_json_value(first_event, events):
+    depth = 1 if first_event in ("start_map", "start_array") else 0
+    while depth:
+        _, event, _ = next(events)
+        if event in ("start_map", "start_array"):
+            depth += 1
+        elif event in ("end_map", "end_array"):
+            depth -= 1
+
+# 由事件組出目前值
+def _build_json_value(first_event, first_value, events):
+    if first_event not in ("start_map", "start_array"):
+        return first_value
+    root = {} if first_event == "start_map" else []
+    stack = [root]
+    key = None
+    while stack:
+        _, event, value = next(events)
+        container = stack[-1]
+        if event == "map_key":
+            key = value
+            continue
+        if event in ("end_map", "end_array"):
+            stack.pop()
+            continue
+        if event in ("start_map", "start_array"):
+            value = {} if event == "start_map" else []
+        if isinstance(container, dict):
+            container[key] = value
+        else:
+            container.append(value)
+        if event in ("start_map", "start_array"):
+            stack.append(value)
+    return root
+
+class _FlattenFrame:
+    __slots__ = ("kind", "path", "buffer")
+
+    def __init__(self, kind, path, buffer=None):
+        self.kind = kind      # node：節點物件；children：categories / subcategories；items：items 陣列
+        self.path = path
+        self.buffer = buffer  # 經由自訂鍵進入、尚未確認含 items/categories/subcategories 的節點，先暫存詞條
+
+# 由 JSON 事件串流逐筆產生 (key, 扁平詞條)，記憶體只與巢狀深度及單一 item 大小相關。
+# 與 flatten_sememe_data 產生相同的詞條集合，但依文件順序輸出（items 不一定排在子分類之前）
+def iter_flattened_entries(events, keep_raw=False):
+    events = iter(events)
+    _, event, value = next(events)
+    if event != "start_map":
+        _skip_json_value(event, events)
+        return
+    stack = [_FlattenFrame("node", ())]
+    output = []
+
+    def emit(flattened):
+        for frame in reversed(stack):
+            if frame.buffer is not None:
+                frame.buffer.append(flattened)
+                return
+        output.append(flattened)
+
+    while stack:
+        _, event, value = next(events)
+        frame = stack[-1]
+        if event in ("end_map", "end_array"):
+            stack.pop()  # 未確認的節點連同暫存詞條一併捨棄
+        elif frame.kind == "items":
+            if event == "start_map":
+                flattened = _flatten_item(_build_json_value(event, value, events), frame.path, keep_raw)
+                if flattened:
+                    emit(flattened)
+            else:
+                _skip_json_value(event, events)
+        elif frame.kind == "children":
+            name = value
+            _, event, value = next(events)
+            if event == "start_map":
+                stack.append(_FlattenFrame("node", frame.path + (name,)))
+            else:
+                _skip_json_value(event, events)
+        else:
+            key = value
+            _, event, value = next(events)
+            if key in NODE_KEYS and frame.buffer is not None:
+                buffered, frame.buffer = frame.buffer, None
+                for flattened in buffered:
+                    emit(flattened)
+            if key == "items" and event == "start_array":
+                stack.append(_FlattenFrame("items", frame.path))
+            elif key in ("categories", "subcategories") and event == "start_map":
+                stack.append(_FlattenFrame("children", frame.path))
+            elif key not in NODE_KEYS and event == "start_map":
+                stack.append(_FlattenFrame("node", frame.path + (key,), buffer=[]))
+            else:
+                _skip_json_value(event, events)
+        if output:
+            yield from output
+            output.clear()
+
+# 精簡輸出：.jsonl 每行一筆 {"key": ..., "entry": ...}，其餘為無縮排的單一 JSON 物件
+def _write_flattened_entry(f, key, entry, jsonl, first):
+    if jsonl:
+        f.write(json.dumps({"key": key, "entry": entry}, ensure_ascii=False, separators=(",", ":")) + "\n")
+    else:
+        f.write(("" if first else ",") + json.dumps(key, ensure_ascii=False) + ":")
+        f.write(json.dumps(entry, ensure_ascii=False, separators=(",", ":")))
+
+def write_flattened_data(entries, output_path):
+    items = entries.items() if isinstance(entries, dict) else entries
+    jsonl = output_path.endswith(".jsonl")
+    count = 0
+    with open(output_path, "w", encoding="utf-8") as f:
+        f.write("" if jsonl else "{")
+        for key, entry in items:
+            _write_flattened_entry(f, key, entry, jsonl, first=not count)
+            count += 1
+        f.write("" if jsonl else "}")
+    return count
+
+def iter_flattened_file(path):
+    with open(path, "r", encoding="utf-8") as f:
+        if path.endswith(".jsonl"):
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    yield record["key"], record["entry"]
+        else:
+            yield from json.load(f).items()
+
 # 分類邏輯設定
 CATEGORY_PREFIX_TO_TYPE = {
     # Basic
@@ -663,14 +890,39 @@ CATEGORY_PREFIX_TO_TYPE = {
 WEATHER_OVERRIDE = ["冷鋒", "暖鋒", "滯留鋒", "鋒面雨", "雷陣雨", "短時強降雨", "間歇性小雨", "霜凍", "揚沙", "晴朗無雲", "大雷雨", "豪雨", "雷擊"]
 CLIMATE_EXCLUDE_FROM_WEATHER = ["強降雨事件", "年降雨量", "梅雨季", "平均氣溫變化", "氣候區劃"]
 
-def build_precise_maps(flattened_data):
+# 語意關鍵詞線索（依序為優先順序，先符合者為準）
+CLUE_KEYWORD_RULES = [
+    ("climate", ("氣候",)),
+    ("weather", ("天氣", "雷", "風", "雨", "溫", "霜", "雪")),
+    ("geo_feature", ("地理", "地形", "地貌", "山", "海", "灘", "谷", "湖", "溪", "坪", "島")),
+    ("location", ("城市", "都市", "區", "鄉", "鎮", "村", "里", "行政", "縣", "市")),
+]
+
+# 關鍵詞 ➜ 規則序號；同一關鍵詞出現在多條規則時取最前面的規則
+def _clue_keyword_ranks(rules):
+    ranks = {}
+    for rank, (_, keywords) in enumerate(rules):
+        for keyword in keywords:
+            ranks.setdefault(keyword, rank)
+    return ranks
+
+# 逐筆分類本體詞條（flattened_data 可為 dict 或 (key, entry) 迭代器）；word_categories 為 詞 ➜ 所屬分類集合 的反向表，與 category_term_sets 同步維護
+def classify_entries(flattened_data):
     category_term_sets = defaultdict(set)
+    word_categories = defaultdict(set)
     custom_synonym_map = {}
     classified_terms = set()
     unclassified_terms = set()
-    reclassified_terms = []
+    category_index = PrefixTrie(CATEGORY_PREFIX_TO_TYPE)
+    clue_matcher = KeywordMatcher(_clue_keyword_ranks(CLUE_KEYWORD_RULES))
+
+    def add_term(cat_type, word):
+        category_term_sets[cat_type].add(word)
+        word_categories[word].add(cat_type)
+        classified_terms.add(word)
 
-    for key, entry in flattened_data.items():
+    items = flattened_data.items() if isinstance(flattened_data, dict) else flattened_data
+    for key, entry in items:
         zh_entry = entry.get("zh", key)
         synonyms = entry.get("synonyms", [])
         zh_words = zh_entry if isinstance(zh_entry, list) else [zh_entry]
@@ -692,42 +944,34 @@ def build_precise_maps(flattened_data):
         # 1. 由 path / categories 判斷（最強依據）
         for cat in entry.get("categories", []):
             cat_lower = str(cat).lower()
-            for prefix, cat_type in CATEGORY_PREFIX_TO_TYPE.items():
-                if cat_lower.startswith(prefix):
-                    entry["classification"].append(cat_type)
-                    entry["triggered_by"].append(cat_lower)
-                    category_term_sets[cat_type].add(standard_word)
-                    classified_terms.add(standard_word)
-                    classified = True
-                    break
-            if classified:
+            cat_type = category_index.longest(cat_lower)
+            if cat_type:
+                entry["classification"].append(cat_type)
+                entry["triggered_by"].append(cat_lower)
+                add_term(cat_type, standard_word)
+                classified = True
                 break
 
         # 2. 由 id 判斷
         if not classified and entry.get("id"):
             item_id = entry.get("id", "").lower()
-            for prefix, cat_type in CATEGORY_PREFIX_TO_TYPE.items():
-                if item_id.startswith(prefix):
-                    entry["classification"].append(cat_type)
-                    entry["triggered_by"].append("id:" + item_id)
-                    category_term_sets[cat_type].add(standard_word)
-                    classified_terms.add(standard_word)
-                    classified = True
-                    break
+            cat_type = category_index.longest(item_id)
+            if cat_type:
+                entry["classification"].append(cat_type)
+                entry["triggered_by"].append("id:" + item_id)
+                add_term(cat_type, standard_word)
+                classified = True
 
         # 3. 由 related_items 判斷
         if not classified:
             for rel_id in entry.get("related_items", []):
                 rel_id = str(rel_id).lower()
-                for prefix, cat_type in CATEGORY_PREFIX_TO_TYPE.items():
-                    if rel_id.startswith(prefix):
-                        entry["classification"].append(cat_type)
-                        entry["triggered_by"].append("related:" + rel_id)
-                        category_term_sets[cat_type].add(standard_word)
-                        classified_terms.add(standard_word)
-                        classified = True
-                        break
-                if classified:
+                cat_type = category_index.longest(rel_id)
+                if cat_type:
+                    entry["classification"].append(cat_type)
+                    entry["triggered_by"].append("related:" + rel_id)
+                    add_term(cat_type, standard_word)
+                    classified = True
                     break
 
         # 4. 語意關鍵詞（linked_sememe、tags、concepts、路徑文字）
@@ -744,21 +988,13 @@ def build_precise_maps(flattened_data):
                 if isinstance(concepts.get("parent"), str): clues.append(concepts["parent"])
             clues += entry.get("categories", [])
             for clue in filter(None, clues):
-                clue_norm = st.normalize_text(clue)
-                if "氣候" in clue_norm:
-                    cat_type = "climate"
-                elif any(kw in clue_norm for kw in ("天氣", "雷", "風", "雨", "溫", "霜", "雪")):
-                    cat_type = "weather"
-                elif any(kw in clue_norm for kw in ("地理", "地形", "地貌", "山", "海", "灘", "谷", "湖", "溪", "坪", "島")):
-                    cat_type = "geo_feature"
-                elif any(kw in clue_norm for kw in ("城市", "都市", "區", "鄉", "鎮", "村", "里", "行政", "縣", "市")):
-                    cat_type = "location"
-                else:
+                ranks = clue_matcher.labels(st.normalize_text(clue))
+                if not ranks:
                     continue
+                cat_type = CLUE_KEYWORD_RULES[min(ranks)][0]
                 entry["classification"].append(cat_type)
                 entry["triggered_by"].append("semantic:" + clue)
-                category_term_sets[cat_type].add(standard_word)
-                classified_terms.add(standard_word)
+                add_term(cat_type, standard_word)
                 classified = True
                 break
 
@@ -766,37 +1002,151 @@ def build_precise_maps(flattened_data):
         if not classified:
             location_suffixes = ["市", "區", "鄉", "鎮", "村", "里", "島"]
             if any(isinstance(w, str) and w and w[-1] in location_suffixes for w in zh_words):
-                category_term_sets["location"].add(standard_word)
+                add_term("location", standard_word)
                 entry["classification"].append("location")
                 entry["triggered_by"].append("suffix_match")
-                classified_terms.add(standard_word)
                 classified = True
 
         # 6. 未分類
         if not classified:
             unclassified_terms.add(standard_word)
 
-    # 最後語意再分類修正（例如天氣與氣候邊界）
+    return custom_synonym_map, category_term_sets, classified_terms, unclassified_terms, word_categories
+
+# 最後語意再分類修正（例如天氣與氣候邊界）：含天氣優先詞者移至 weather
+#   原分類取 category_term_sets 中第一個含該詞的分類（依分類建立順序），改由反向表查得
+def reclassify_weather_terms(category_term_sets, classified_terms, word_categories):
+    reclassified_terms = []
+    override_matcher = KeywordMatcher(dict.fromkeys(WEATHER_OVERRIDE, True))
+    climate_excluded = set(CLIMATE_EXCLUDE_FROM_WEATHER)
+    category_rank = {cat: rank for rank, cat in enumerate(category_term_sets)}
     for word in list(classified_terms):
-        original = None
-        for cat, terms in category_term_sets.items():
-            if word in terms:
-                original = cat
-                break
-        if any(keyword in word for keyword in WEATHER_OVERRIDE):
-            if word not in CLIMATE_EXCLUDE_FROM_WEATHER and original != "weather":
-                if original:
-                    category_term_sets[original].remove(word)
-                category_term_sets["weather"].add(word)
-                reclassified_terms.append((word, original, "weather"))
+        if word in climate_excluded or not override_matcher.labels(word):
+            continue
+        categories = word_categories.get(word)
+        original = min(categories, key=category_rank.__getitem__) if categories else None
+        if original != "weather":
+            if original:
+                category_term_sets[original].remove(word)
+            category_term_sets["weather"].add(word)
+            reclassified_terms.append((word, original, "weather"))
+    return reclassified_terms
 
+def build_precise_maps(flattened_data):
+    custom_synonym_map, category_term_sets, classified_terms, unclassified_terms, word_categories = classify_entries(
+        flattened_data
+    )
+    reclassified_terms = reclassify_weather_terms(category_term_sets, classified_terms, word_categories)
     return custom_synonym_map, category_term_sets, classified_terms, unclassified_terms, reclassified_terms
 
+# 自製同義詞向量庫的待嵌入文字：每個詞條一筆，分類為 location 者另為每個詞形增補地區向量
+# id 取自詞條鍵（custom_{key} / city_{key}_{詞形}），增刪其他詞條不會讓既有列的 id 位移
+def collect_embedding_texts(entries):
+    texts, ids, metas = [], [], []
+    items = entries.items() if isinstance(entries, dict) else entries
+    for key, entry in items:
+        zh_entry = entry.get("zh", key)
+        synonyms = entry.get("synonyms", [])
+        categories = entry.get("categories", {})
+        if isinstance(categories, tuple):
+            categories = list(categories)  # 與 metadata JSON 往返後的型別一致，增量比對才不會誤判
+
+        if isinstance(zh_entry, list):
+            standard_word = zh_entry[0]
+            parts = zh_entry.copy()
+        else:
+            standard_word = zh_entry
+            parts = [zh_entry]
+
+        parts.extend(synonyms)
+        parts = list(dict.fromkeys(filter(None, parts)))  # 去重與清理（保留原順序，跨行程結果一致）
+
+        description = "、".join(parts) + "。這些是相關語義擴展資訊。"
+        merged = f"[Q] {standard_word} [SEP] {description}"
+
+        texts.append(merged)
+        ids.append(f"custom_{key}")
+        metas.append({
+            "term": standard_word,
+            "synonyms": synonyms,
+            "categories": categories,
+            "is_location": False
+        })
+
+        # 增補地區向量（僅限分類為 location）
+        if isinstance(entry.get("classification"), list) and "location" in entry["classification"]:
+            for loc_term in parts:
+                texts.append(f"[Q] {loc_term} [SEP] {standard_word}地區")
+                ids.append(f"city_{key}_{loc_term}")
+                metas.append({
+                    "term": loc_term,
+                    "synonyms": [],
+                    "categories": {"location": True},
+                    "is_location": True
+                })
+    return texts, ids, metas
+
+# 編譯本體：壓平結果 ➜ 分類 ➜ 單一版本化二進位檔，供 sememe_tools / build_vector_db 直接載入
+def compile_ontology_artifact(flattened_data, artifact_path, maps=None):
+    if not isinstance(flattened_data, dict):
+        flattened_data = dict(flattened_data)
+    if maps is None:
+        maps = build_precise_maps(flattened_data)
+    custom_synonym_map, category_term_sets, classified_terms, unclassified_terms, reclassified_terms = maps
+    entries = {key: {**entry, "categories": list(entry.get("categories", []))} for key, entry in flattened_data.items()}
+    texts, ids, metas = collect_embedding_texts(entries)
+    st_module.write_ontology_artifact(artifact_path, {
+        "synonym_map": custom_synonym_map,
+        "category_term_sets": {cat: set(terms) for cat, terms in category_term_sets.items()},
+        "classified_terms": set(classified_terms),
+        "unclassified_terms": set(unclassified_terms),
+        "reclassified_terms": list(reclassified_terms),
+        "entries": entries,
+        "embedding": {"texts": texts, "ids": ids, "metas": metas},
+    })
+    return artifact_path
+
+# 串流版：壓平、分類與寫出逐筆進行，不需整份載入原始本體或保留全部詞條。
+# 重複的 key 依 dict 覆寫語意處理（位置取第一次出現、內容取最後一筆）：第一遍只記錄 key，
+# 並暫存重複 key 的最後一筆；詞條在下一筆被讀取時（此時已完成分類）才寫出，含 classification / triggered_by
+def build_precise_maps_streaming(input_path, output_path, keep_raw=False):
+    seen, duplicates = set(), {}
+    for key, entry in iter_flattened_entries(iter_json_events(input_path), keep_raw=keep_raw):
+        if key in seen:
+            duplicates[key] = entry
+        seen.add(key)
+    duplicate_keys = set(duplicates)
+    del seen
+
+    jsonl = output_path.endswith(".jsonl")
+    with open(output_path, "w", encoding="utf-8") as f:
+        f.write("" if jsonl else "{")
+
+        def entries():
+            previous, written = None, 0
+            for key, entry in iter_flattened_entries(iter_json_events(input_path), keep_raw=keep_raw):
+                if key in duplicate_keys:
+                    if key not in duplicates:
+                        continue
+                    entry = duplicates.pop(key)
+                if previous:
+                    _write_flattened_entry(f, *previous, jsonl, first=not written)
+                    written += 1
+                previous = (key, entry)
+                yield previous
+            if previous:
+                _write_flattened_entry(f, *previous, jsonl, first=not written)
+
+        maps = build_precise_maps(entries())
+        f.write("" if jsonl else "}")
+    return maps
+
 # ==== 主程式 ====
 if __name__ == "__main__":
     with open("/content/Weather-AI-Agent/sememe_synonym.json", "r", encoding="utf-8") as f:
         raw_data = json.load(f)
-    flattened_data = flatten_sememe_data(raw_data)
+    flattened_data = flatten_sememe_data(raw_data, keep_raw=False)
+    del raw_data
     custom_synonym_map, category_term_sets, classified_terms, unclassified_terms, reclassified_terms = build_precise_maps(flattened_data)
 
     print(f"\n自訂 Synonym Map 已載入，共 {len(custom_synonym_map)} 筆\n")
@@ -818,6 +1168,10 @@ if __name__ == "__main__":
     st_module.set_custom_synonyms(flattened_data)
 
     # 儲存結果
-    with open("/content/Weather-AI-Agent/flattened_sememe_synonym.json", "w", encoding="utf-8") as f:
-        json.dump(flattened_data, f, ensure_ascii=False, indent=2)
+    write_flattened_data(flattened_data, "/content/Weather-AI-Agent/flattened_sememe_synonym.json")
     print("已儲存為：flattened_sememe_synonym.json")
+    compile_ontology_artifact(
+        flattened_data, "/content/Weather-AI-Agent/ontology.bin",
+        maps=(custom_synonym_map, category_term_sets, classified_terms, unclassified_terms, reclassified_terms),
+    )
+    print("已編譯為：ontology.bin")
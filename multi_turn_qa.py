@@ -64,7 +64,7 @@ def generate_answer_with_groq(
         return f"呼叫 Groq API 失敗：{str(e)}"
 
 # 多回合 QA 函數
-def multi_turn_qa(initial_query,index_list,model,tokenizer,device,api_key,max_turns=3,topk=5,verbose=True,stop_words=None,dynamic_next_query=True):
+def multi_turn_qa(initial_query,index_list,model,tokenizer,device,api_key,max_turns=3,topk=5,verbose=True,stop_words=None,dynamic_next_query=True,query_cache=None):
     """
     多回合問答流程
 
@@ -78,6 +78,7 @@ def multi_turn_qa(initial_query,index_list,model,tokenizer,device,api_key,max_tu
         verbose (bool): 是否輸出過程
         stop_words (list): 碰到這些關鍵字就停止
         dynamic_next_query (bool): 根據回答自動產生下一個問題
+        query_cache (QueryEmbeddingCache): 查詢向量快取，可跨多次呼叫共用
     """
     if stop_words is None:
         stop_words = ["無法回答", "缺少資料", "無相關資訊"]
@@ -97,7 +98,8 @@ def multi_turn_qa(initial_query,index_list,model,tokenizer,device,api_key,max_tu
                 model=model,
                 tokenizer=tokenizer,
                 device=device,
-                topk=topk
+                topk=topk,
+                query_cache=query_cache
             )
         except Exception as e:
             print(f"向量檢索失敗：{e}")
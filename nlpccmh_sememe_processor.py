@@ -1,6 +1,11 @@
 # nlpccmh_sememe_processor.py
 
+import os
 import json
+import hashlib
+import shutil
+import multiprocessing
+from itertools import islice
 from tqdm import tqdm
 import sememe_tools as st
 
@@ -14,26 +19,179 @@ def process_nlpccmh_sample(sample, base_id="nlpcc", index=0):
     sememe_map = sememe_analysis["sememe_map"]
 
     for path_id, triple in enumerate(sample.get("path", [])):
-        head = triple[0].split(" ||| ")[0]
-        relation = triple[1]
-        tail = triple[2].split(" ||| ")[0]
-        sentence = f"{head} {relation} {tail}"
-
         result.append({
             "id": f"{base_id}_{index}_{path_id}",
             "question": question,
             "question_sememe": sememe_tags,
             "question_sememe_map": sememe_map,
-            "triple_sentence": sentence,
-            "head": head,
-            "relation": relation,
-            "tail": tail
+            **_parse_triple(triple)
         })
 
     return result
 
+def _parse_triple(triple):
+    head = triple[0].split(" ||| ")[0]
+    relation = triple[1]
+    tail = triple[2].split(" ||| ")[0]
+    return {
+        "triple_sentence": f"{head} {relation} {tail}",
+        "head": head,
+        "relation": relation,
+        "tail": tail
+    }
+
+# ---- 去重中介格式：問句表 + 三元組表 ----
+# 問句表每個不重複問句一列：{"qid", "question", "question_sememe", "question_sememe_map", "triple_ids"}
+# 三元組表每條路徑一列：{"id", "qid", "triple_sentence", "head", "relation", "tail"}
+# 同一問句在整份資料集只做一次語義分析，三元組以 qid 參照問句
+def process_nlpccmh_sample_dedup(sample, question_table, base_id="nlpcc", index=0):
+    paths = sample.get("path", [])
+    if not paths:
+        return []
+    question = sample["q"]
+    question_record = question_table.get(question)
+    is_new = question_record is None
+    if is_new:
+        sememe_analysis = st.analyze_sentence(question)
+        question_record = {
+            "qid": f"q_{len(question_table)}",
+            "question": question,
+            "question_sememe": sememe_analysis["sememe_tags"],
+            "question_sememe_map": sememe_analysis["sememe_map"],
+            "triple_ids": []
+        }
+        question_table[question] = question_record
+
+    triples = []
+    for path_id, triple in enumerate(paths):
+        triple_id = f"{base_id}_{index}_{path_id}"
+        question_record["triple_ids"].append(triple_id)
+        triples.append({"id": triple_id, "qid": question_record["qid"], **_parse_triple(triple)})
+    return triples
+
+def _write_question_table(question_table, questions_path):
+    with open(questions_path, "w", encoding="utf-8") as f:
+        for record in question_table.values():
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+# 串流處理整份資料集並輸出問句表與三元組表（三元組依原始順序整批寫入）
+def process_nlpccmh_file_dedup(input_path, questions_path, triples_path, batch_size=1000, base_id="nlpcc"):
+    question_table = {}
+    buffer = []
+    with open(triples_path, "w", encoding="utf-8") as out_f:
+        for index, sample in enumerate(tqdm(iter_json_array(input_path), desc="處理 NLPCC-MH 樣本（去重）")):
+            for entry in process_nlpccmh_sample_dedup(sample, question_table, base_id=base_id, index=index):
+                buffer.append(json.dumps(entry, ensure_ascii=False) + "\n")
+            if len(buffer) >= batch_size:
+                out_f.writelines(buffer)
+                buffer.clear()
+        out_f.writelines(buffer)
+    _write_question_table(question_table, questions_path)
+    print(f"不重複問句 {len(question_table)} 筆：{questions_path}, {triples_path}")
+
+# 將既有逐三元組的 *_sememe.jsonl 轉為問句表 + 三元組表（不重新做語義分析）
+def split_sememe_jsonl(sememe_jsonl_path, questions_path, triples_path):
+    question_table = {}
+    with open(sememe_jsonl_path, "r", encoding="utf-8") as in_f, open(triples_path, "w", encoding="utf-8") as out_f:
+        for line in in_f:
+            entry = json.loads(line)
+            question = entry["question"]
+            question_record = question_table.get(question)
+            if question_record is None:
+                question_record = {
+                    "qid": f"q_{len(question_table)}",
+                    "question": question,
+                    "question_sememe": entry["question_sememe"],
+                    "question_sememe_map": entry["question_sememe_map"],
+                    "triple_ids": []
+                }
+                question_table[question] = question_record
+            question_record["triple_ids"].append(entry["id"])
+            out_f.write(json.dumps({
+                "id": entry["id"],
+                "qid": question_record["qid"],
+                "triple_sentence": entry["triple_sentence"],
+                "head": entry["head"],
+                "relation": entry["relation"],
+                "tail": entry["tail"]
+            }, ensure_ascii=False) + "\n")
+    _write_question_table(question_table, questions_path)
+
+# 串流解析頂層 JSON 陣列：逐塊讀檔並逐一 yield 元素，不整份載入
+# 語法與 json.load 一致：元素間恰好一個逗號、不允許空元素或結尾逗號，"]" 之後只能有空白
+def iter_json_array(input_path, chunk_size=1 << 20):
+    decoder = json.JSONDecoder()
+    with open(input_path, "r", encoding="utf-8") as f:
+        # expect：open 等待 "["、first 等待第一個元素或 "]"、value 等待元素、sep 等待 "," 或 "]"、end 陣列已結束
+        buffer, pos, expect, eof = "", 0, "open", False
+        while True:
+            while pos < len(buffer) and buffer[pos] in " \t\r\n":
+                pos += 1
+            if pos < len(buffer):
+                char = buffer[pos]
+                if expect == "end":
+                    raise ValueError(f"JSON 陣列結束後仍有多餘內容：{input_path}")
+                if expect == "open":
+                    if char != "[":
+                        raise ValueError(f"頂層必須是 JSON 陣列：{input_path}")
+                    expect = "first"
+                    pos += 1
+                    continue
+                if expect == "sep":
+                    if char == ",":
+                        expect = "value"
+                    elif char == "]":
+                        expect = "end"
+                    else:
+                        raise ValueError(f"JSON 陣列元素之間必須以逗號分隔：{input_path}")
+                    pos += 1
+                    continue
+                if char in ",]":
+                    if expect == "first" and char == "]":
+                        expect = "end"
+                        pos += 1
+                        continue
+                    raise ValueError(f"JSON 陣列有空元素或結尾逗號：{input_path}")
+                try:
+                    item, end = decoder.raw_decode(buffer, pos)
+                    # 元素後須接分隔字元才算完整：數值可能被區塊邊界截斷（如 23|456、1.|5），需讀入更多資料確認
+                    if eof or (end < len(buffer) and buffer[end] in " \t\r\n,]"):
+                        pos = end
+                        expect = "sep"
+                        yield item
+                        continue
+                except json.JSONDecodeError:
+                    # 元素被切在區塊邊界，讀入更多資料後重試
+                    if eof:
+                        raise
+            elif eof:
+                if expect == "end":
+                    return
+                raise ValueError(f"JSON 陣列未正常結束：{input_path}")
+            chunk = f.read(chunk_size)
+            buffer, pos = buffer[pos:] + chunk, 0
+            eof = not chunk
+
+# 以 generator 逐筆產生處理後的輸出列
+def iter_processed_samples(samples, base_id="nlpcc"):
+    for index, sample in enumerate(samples):
+        yield from process_nlpccmh_sample(sample, base_id=base_id, index=index)
+
 # 分批處理整份資料集並輸出為 JSONL
-def process_nlpccmh_file(input_path, output_path, batch_size=1000):
+# streaming=True 時以串流解析輸入，每累積 batch_size 列輸出才整批寫入，記憶體用量與資料量無關
+def process_nlpccmh_file(input_path, output_path, batch_size=1000, streaming=False):
+    if streaming:
+        rows = iter_processed_samples(tqdm(iter_json_array(input_path), desc="處理 NLPCC-MH 樣本"))
+        buffer = []
+        with open(output_path, "w", encoding="utf-8") as out_f:
+            for entry in rows:
+                buffer.append(json.dumps(entry, ensure_ascii=False) + "\n")
+                if len(buffer) >= batch_size:
+                    out_f.writelines(buffer)
+                    buffer.clear()
+            out_f.writelines(buffer)
+        return
+
     with open(input_path, "r", encoding="utf-8") as f:
         data = json.load(f)
 
@@ -45,8 +203,111 @@ def process_nlpccmh_file(input_path, output_path, batch_size=1000):
                 for entry in processed:
                     out_f.write(json.dumps(entry, ensure_ascii=False) + "\n")
 
+# ---- 多行程語義標註：每個 worker 只初始化一次 HowNet / jieba / 自訂同義詞表 ----
+def _init_annotate_worker(custom_synonym_map, inject_hownet, jieba_cache_path=None, lexicon_path=None):
+    st.set_custom_synonym_map(custom_synonym_map)
+    if lexicon_path:
+        st.load_sememe_lexicon(lexicon_path)
+    if inject_hownet:
+        st.inject_all_hownet_words(cache_path=jieba_cache_path)
+
+def _annotate_chunk(task):
+    chunk_id, start, samples, base_id = task
+    lines = []
+    for offset, sample in enumerate(samples):
+        for entry in process_nlpccmh_sample(sample, base_id=base_id, index=start + offset):
+            lines.append(json.dumps(entry, ensure_ascii=False) + "\n")
+    return chunk_id, lines
+
+def _chunk_path(checkpoint_dir, chunk_id):
+    return os.path.join(checkpoint_dir, f"chunk_{chunk_id:06d}.jsonl")
+
+def _file_sha1(path, block_size=1 << 20):
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+# 影響標註結果的設定：自訂同義詞對照、詞典檔內容、是否注入 HowNet 詞彙；不同設定產生的區塊不可混用
+def _annotate_settings(custom_synonym_map, inject_hownet, lexicon_path):
+    synonym_json = json.dumps(sorted(custom_synonym_map.items()), ensure_ascii=False)
+    return {
+        "custom_synonym_map_sha1": hashlib.sha1(synonym_json.encode("utf-8")).hexdigest(),
+        "inject_hownet": bool(inject_hownet),
+        "lexicon_sha1": _file_sha1(lexicon_path) if lexicon_path else None,
+    }
+
+# 平行處理整份資料集：輸入以串流切成 chunk_size 筆的區塊，各區塊完成後寫入 checkpoint_dir，
+# 中斷後以相同參數重跑會略過已完成的區塊；全部完成後依區塊順序合併為 output_path。
+# manifest 另記錄輸入檔內容雜湊、同義詞對照、詞典檔與 inject_hownet，輸入或設定不同時拒絕沿用舊區塊。
+# id 與單行程版本相同（nlpcc_{index}_{path_id}），輸出順序固定。
+def process_nlpccmh_file_parallel(
+    input_path,
+    output_path,
+    num_workers=4,
+    chunk_size=500,
+    checkpoint_dir=None,
+    base_id="nlpcc",
+    inject_hownet=False,
+    keep_checkpoints=False,
+    jieba_cache_path=None,
+    lexicon_path=None
+):
+    checkpoint_dir = checkpoint_dir or output_path + ".chunks"
+    os.makedirs(checkpoint_dir, exist_ok=True)
+
+    manifest_path = os.path.join(checkpoint_dir, "manifest.json")
+    manifest = {
+        "input_path": os.path.abspath(input_path),
+        "input_sha1": _file_sha1(input_path),
+        "chunk_size": chunk_size,
+        "base_id": base_id,
+        **_annotate_settings(st.custom_synonym_map, inject_hownet, lexicon_path),
+    }
+    if os.path.exists(manifest_path):
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            if json.load(f) != manifest:
+                raise ValueError(f"checkpoint 參數不一致，請清除 {checkpoint_dir} 後重跑")
+    else:
+        with open(manifest_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False)
+
+    num_chunks = 0
+    def tasks():
+        nonlocal num_chunks
+        samples = iter_json_array(input_path)
+        while True:
+            chunk = list(islice(samples, chunk_size))
+            if not chunk:
+                break
+            chunk_id = num_chunks
+            num_chunks += 1
+            if not os.path.exists(_chunk_path(checkpoint_dir, chunk_id)):
+                yield chunk_id, chunk_id * chunk_size, chunk, base_id
+
+    ctx = multiprocessing.get_context("spawn")
+    with ctx.Pool(
+        num_workers,
+        initializer=_init_annotate_worker,
+        initargs=(st.custom_synonym_map, inject_hownet, jieba_cache_path, lexicon_path),
+    ) as pool:
+        for chunk_id, lines in tqdm(pool.imap_unordered(_annotate_chunk, tasks()), desc="平行語義標註（區塊）"):
+            path = _chunk_path(checkpoint_dir, chunk_id)
+            with open(path + ".tmp", "w", encoding="utf-8") as f:
+                f.writelines(lines)
+            os.replace(path + ".tmp", path)
+
+    with open(output_path, "w", encoding="utf-8") as out_f:
+        for chunk_id in range(num_chunks):
+            with open(_chunk_path(checkpoint_dir, chunk_id), "r", encoding="utf-8") as f:
+                shutil.copyfileobj(f, out_f)
+    if not keep_checkpoints:
+        shutil.rmtree(checkpoint_dir)
+
 if __name__ == "__main__":
     process_nlpccmh_file(
         input_path="/content/NLPCC-MH/data/nlpcc-mh.train.json",
-        output_path="/content/NLPCC-MH/data/nlpcc-mh.train_sememe.jsonl"
+        output_path="/content/NLPCC-MH/data/nlpcc-mh.train_sememe.jsonl",
+        streaming=True
     )
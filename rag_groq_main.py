@@ -53,7 +53,7 @@ def build_rag_prompt(query, retrieved_results, history=[], mode="standard"):
     return prompt
 
 # ========== 檢索並顯示 ==========
-def run_query_and_get_results(query, indices, metadatas, model, tokenizer, device, topk=5):
+def run_query_and_get_results(query, indices, metadatas, model, tokenizer, device, topk=5, query_cache=None):
     results = vu.combine_search(
         query=query,
         indices=indices,
@@ -61,7 +61,8 @@ def run_query_and_get_results(query, indices, metadatas, model, tokenizer, devic
         model=model,
         tokenizer=tokenizer,
         device=device,
-        topk=topk
+        topk=topk,
+        query_cache=query_cache
     )
     print("\n檢索結果摘要（TopK）：")
     for r in results:
@@ -91,6 +92,7 @@ def generate_answer_with_groq(prompt):
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 tokenizer = AutoTokenizer.from_pretrained("BAAI/bge-base-zh")
 hf_model = AutoModel.from_pretrained("BAAI/bge-base-zh").to(device).eval()
+query_cache = vu.QueryEmbeddingCache(max_size=1024, ttl=3600)
 
 chat_history = []
 print("\n歡迎使用 Semantic RAG 多輪問答系統")
@@ -99,10 +101,13 @@ print("輸入 `exit` 結束對話。\n")
 while True:
     user_input = input("使用者：")
     if user_input.strip().lower() in {"exit", "quit", "bye", "再見", "謝謝"}:
+        print(f"查詢向量快取：{query_cache.stats()}")
         print("對話結束，謝謝使用！")
         break
 
-    search_results = run_query_and_get_results(user_input, indices, metadatas, hf_model, tokenizer, device)
+    search_results = run_query_and_get_results(
+        user_input, indices, metadatas, hf_model, tokenizer, device, query_cache=query_cache
+    )
     prompt = build_rag_prompt(user_input, search_results, history=chat_history, mode="standard")
     answer = generate_answer_with_groq(prompt)
 
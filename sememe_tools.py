@@ -2,7 +2,12 @@
 
 import os
 import json
+import mmap
+import pickle
+import marshal
 import jieba
+import numpy as np
+from functools import lru_cache
 import OpenHowNet
 from opencc import OpenCC
 
@@ -10,34 +15,253 @@ cc_tw2sp = OpenCC('tw2sp')
 custom_synonym_map = {}
 custom_synonyms = {}
 custom_sememe_relations = {}
+_synonym_to_entry = {}
+_reverse_relations = {}
 
-try:
-    OpenHowNet.download()
-except Exception as e:
-    # 建議改用 logging 或完全移除
-    pass
+_hownet = None
 
-hownet = OpenHowNet.HowNetDict()
+# HowNet 延遲初始化：import 時不連網也不載入，第一次使用才建立 HowNetDict；
+# 本機缺少資料時才呼叫 OpenHowNet.download()
+def get_hownet(download=True):
+    global _hownet
+    if _hownet is None:
+        hownet_dict = OpenHowNet.HowNetDict()
+        if not hasattr(hownet_dict, "en_map") and download:
+            OpenHowNet.download()
+            hownet_dict = OpenHowNet.HowNetDict()
+        if not hasattr(hownet_dict, "en_map"):
+            raise RuntimeError("HowNet 資料不存在，請先執行 OpenHowNet.download()")
+        _hownet = hownet_dict
+    return _hownet
+
+# 相容舊用法 st.hownet
+def __getattr__(name):
+    if name == "hownet":
+        return get_hownet()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 def normalize_text(text):
     text = cc_tw2sp.convert(text)
     text = text.replace("台", "臺")
     return text.lower()
 
-def inject_all_hownet_words(verbose=False):
+# jieba 詞典快取：注入 HowNet 詞彙後的整份前綴詞典 (FREQ, total)，以 marshal 一次載入
+JIEBA_CACHE_VERSION = "hownet-jieba-v1"
+
+def save_jieba_dict_cache(cache_path):
+    jieba.dt.check_initialized()
+    tmp_path = cache_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        marshal.dump((JIEBA_CACHE_VERSION, jieba.dt.FREQ, jieba.dt.total), f)
+    os.replace(tmp_path, cache_path)
+
+def load_jieba_dict_cache(cache_path):
+    with open(cache_path, "rb") as f:
+        version, freq, total = marshal.load(f)
+    if version != JIEBA_CACHE_VERSION:
+        return False
+    with jieba.dt.lock:
+        jieba.dt.FREQ, jieba.dt.total = freq, total
+        jieba.dt.initialized = True
+    clear_sememe_cache(sentence_only=True)
+    return True
+
+# cache_path 存在時直接載入詞典快取（不需載入 HowNet）；否則逐詞注入，並在指定 cache_path 時寫出快取
+def inject_all_hownet_words(verbose=False, cache_path=None):
+    if cache_path and os.path.exists(cache_path) and load_jieba_dict_cache(cache_path):
+        if verbose:
+            print(f"已從 {cache_path} 載入含 HowNet 詞彙的 jieba 詞典")
+        return
     if verbose:
         print("正在注入 HowNet 詞彙進 jieba ...")
-    all_words = set(sense.zh_word for sense in hownet.get_all_senses() if sense.zh_word)
+    all_words = set(sense.zh_word for sense in get_hownet().get_all_senses() if sense.zh_word)
     for word in all_words:
         try:
             jieba.add_word(word)
         except Exception as e:
             if verbose:
                 print(f"加入 {word} 到 jieba 失敗：{e}")
+    clear_sememe_cache(sentence_only=True)
+    if cache_path:
+        save_jieba_dict_cache(cache_path)
     if verbose:
         print(f"已注入 {len(all_words)} 筆 HowNet 詞彙到 jieba")
 
-def sememe_of_sentence(sentence):
+# ---- 精簡詞 → 義原詞典 ----
+# 線上只用到 get_sense(詞)[0] 的義原，因此預先匯出成單一二進位檔，以 mmap 唯讀共享：
+#   詞（UTF-8 依位元組排序後串接）＋ 詞位移表、每詞義原區間、義原 id（uint16）、義原字串表（去重）
+# 查詢以二分搜尋比對位元組，不需常駐 HowNetDict；義原字串只在載入時解碼一次並共用
+SEMEME_LEXICON_MAGIC = b"WASEMLX1"
+
+def _aligned(f):
+    padding = -f.tell() % 8
+    f.write(b"\0" * padding)
+    return f.tell()
+
+# HowNet 全部的中英文詞形；zh_map / en_map 的鍵已去除前後空白，查詢前須同樣 strip 才查得到
+def _hownet_words(hownet_dict):
+    words = set()
+    for sense in hownet_dict.get_all_senses():
+        for attr in ("zh_word", "en_word"):
+            word = (getattr(sense, attr, None) or "").strip()
+            if word:
+                words.add(word)
+    return words
+
+def build_sememe_lexicon(lexicon_path, verbose=False):
+    hownet_dict = get_hownet()
+    words = _hownet_words(hownet_dict)
+
+    entries = []
+    sememe_ids = {}
+    for word in words:
+        sememes = _first_sense_sememes(hownet_dict.get_sense(word))
+        if sememes:
+            entries.append((word.encode("utf-8"), [sememe_ids.setdefault(s, len(sememe_ids)) for s in sememes]))
+    entries.sort(key=lambda entry: entry[0])
+    if len(sememe_ids) > np.iinfo(np.uint16).max:
+        raise ValueError(f"義原數量超過 uint16 上限：{len(sememe_ids)}")
+
+    word_offsets = np.zeros(len(entries) + 1, dtype="<u8")
+    word_offsets[1:] = np.cumsum([len(word) for word, _ in entries])
+    ptr = np.zeros(len(entries) + 1, dtype="<u4")
+    ptr[1:] = np.cumsum([len(ids) for _, ids in entries])
+    ids = np.fromiter((i for _, word_ids in entries for i in word_ids), dtype="<u2", count=int(ptr[-1]))
+    sememe_blobs = [name.encode("utf-8") for name in sememe_ids]
+    sememe_offsets = np.zeros(len(sememe_blobs) + 1, dtype="<u8")
+    sememe_offsets[1:] = np.cumsum([len(blob) for blob in sememe_blobs])
+
+    tmp_path = lexicon_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(SEMEME_LEXICON_MAGIC)
+        sections = []
+        for data in (
+            b"".join(word for word, _ in entries), word_offsets.tobytes(), ptr.tobytes(), ids.tobytes(),
+            b"".join(sememe_blobs), sememe_offsets.tobytes(),
+        ):
+            sections.append(_aligned(f))
+            f.write(data)
+        _aligned(f)
+        f.write(np.asarray(sections + [len(entries), len(sememe_blobs)], dtype="<u8").tobytes())
+        f.write(SEMEME_LEXICON_MAGIC)
+    os.replace(tmp_path, lexicon_path)
+    if verbose:
+        print(f"已匯出義原詞典：{len(entries)} 個詞、{len(sememe_blobs)} 個義原 ➜ {lexicon_path}")
+    return len(entries)
+
+class SememeLexicon:
+    def __init__(self, lexicon_path):
+        self.lexicon_path = lexicon_path
+        with open(lexicon_path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic_size = len(SEMEME_LEXICON_MAGIC)
+        if self._mm[:magic_size] != SEMEME_LEXICON_MAGIC or self._mm[-magic_size:] != SEMEME_LEXICON_MAGIC:
+            raise ValueError(f"不是有效的義原詞典檔：{lexicon_path}")
+        trailer = np.frombuffer(self._mm, dtype="<u8", count=8, offset=len(self._mm) - magic_size - 64)
+        words_at, word_offsets_at, ptr_at, ids_at, sememes_at, sememe_offsets_at, count, sememe_count = map(int, trailer)
+        self._count = count
+        self._words_at = words_at
+        self._word_offsets = np.frombuffer(self._mm, dtype="<u8", count=count + 1, offset=word_offsets_at)
+        self._ptr = np.frombuffer(self._mm, dtype="<u4", count=count + 1, offset=ptr_at)
+        self._ids = np.frombuffer(self._mm, dtype="<u2", count=int(self._ptr[-1]), offset=ids_at)
+        sememe_offsets = np.frombuffer(self._mm, dtype="<u8", count=sememe_count + 1, offset=sememe_offsets_at)
+        self._sememes = tuple(
+            self._mm[sememes_at + int(start):sememes_at + int(end)].decode("utf-8")
+            for start, end in zip(sememe_offsets[:-1], sememe_offsets[1:])
+        )
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, word):
+        return self._find(word) >= 0
+
+    def _word_at(self, row):
+        start = self._words_at + int(self._word_offsets[row])
+        return self._mm[start:self._words_at + int(self._word_offsets[row + 1])]
+
+    def _find(self, word):
+        key = word.encode("utf-8")
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._word_at(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo if lo < self._count and self._word_at(lo) == key else -1
+
+    # 與 _first_sense_sememes(hownet.get_sense(word)) 相同：查無義原時回傳 None
+    def get(self, word):
+        row = self._find(word)
+        if row < 0:
+            return None
+        sememes = self._sememes
+        return tuple(sememes[i] for i in self._ids[self._ptr[row]:self._ptr[row + 1]].tolist())
+
+    # 先釋放指向 mmap 的 numpy 檢視，否則 mmap.close() 會因仍有匯出的緩衝區而失敗
+    def close(self):
+        self._word_offsets = self._ptr = self._ids = None
+        self._mm.close()
+
+_lexicon = None
+
+# 切換查詢來源：傳入 SememeLexicon 改用精簡詞典，傳入 None 改回 HowNet
+def set_sememe_lexicon(lexicon):
+    global _lexicon
+    _lexicon = lexicon
+    clear_sememe_cache()
+
+def load_sememe_lexicon(lexicon_path):
+    lexicon = SememeLexicon(lexicon_path)
+    set_sememe_lexicon(lexicon)
+    return lexicon
+
+# 比對精簡詞典與 HowNet 的查詢結果；words 省略時比對 HowNet 全部的詞（含詞典遺漏者），回傳不一致清單
+def compare_lexicon_with_hownet(lexicon, words=None, sentences=()):
+    hownet_dict = get_hownet()
+    if words is None:
+        words = sorted(_hownet_words(hownet_dict))
+    mismatches = []
+    for word in words:
+        expected = _first_sense_sememes(hownet_dict.get_sense(word))
+        actual = lexicon.get(word)
+        if expected != actual:
+            mismatches.append({"word": word, "hownet": expected, "lexicon": actual})
+
+    previous = _lexicon
+    try:
+        for sentence in sentences:
+            set_sememe_lexicon(None)
+            expected = analyze_sentence(sentence)
+            set_sememe_lexicon(lexicon)
+            actual = analyze_sentence(sentence)
+            if expected != actual:
+                mismatches.append({"sentence": sentence, "hownet": expected, "lexicon": actual})
+    finally:
+        set_sememe_lexicon(previous)
+    return mismatches
+
+# ---- 語義分析快取 ----
+# 詞快取：詞 → 標準詞 → 簡體 → 第一個義項的義原（None 表示查無義原）
+# 句快取（預設關閉）：整句 → sememe_map；兩者在 set_custom_synonym_map 時自動清除，
+# 句快取另於 inject_all_hownet_words（jieba 斷詞改變）時清除
+WORD_CACHE_SIZE = 65536
+SENTENCE_CACHE_SIZE = 0
+
+def _first_sense_sememes(senses):
+    if senses and getattr(senses[0], 'sememes', None):
+        return tuple(s.sememe if hasattr(s, "sememe") else str(s) for s in senses[0].sememes)
+    return None
+
+def _lookup_word_sememes(word):
+    standard_word = custom_synonym_map.get(word, word)
+    simp_word = cc_tw2sp.convert(standard_word)
+    if _lexicon is not None:
+        return _lexicon.get(simp_word)
+    return _first_sense_sememes(get_hownet().get_sense(simp_word))
+
+def _sememe_of_sentence_uncached(sentence):
     words = list(jieba.cut(sentence))
     sememe_map = {}
     skip_next = False
@@ -46,23 +270,55 @@ def sememe_of_sentence(sentence):
             skip_next = False
             continue
         word = words[i]
-        standard_word = custom_synonym_map.get(word, word)
-        simp_word = cc_tw2sp.convert(standard_word)
-        senses = hownet.get_sense(simp_word)
-        if (not senses or not getattr(senses[0], 'sememes', None)) and i + 1 < len(words):
+        sememes = _cached_word_sememes(word)
+        if sememes is None and i + 1 < len(words):
             combined_word = word + words[i + 1]
-            standard_combined_word = custom_synonym_map.get(combined_word, combined_word)
-            combined_simp = cc_tw2sp.convert(standard_combined_word)
-            combined_senses = hownet.get_sense(combined_simp)
-            if combined_senses and getattr(combined_senses[0], 'sememes', None):
-                sememe_map[combined_word] = [s.sememe if hasattr(s, "sememe") else str(s) for s in combined_senses[0].sememes]
+            combined_sememes = _cached_word_sememes(combined_word)
+            if combined_sememes is not None:
+                sememe_map[combined_word] = combined_sememes
                 skip_next = True
                 continue
-        if senses and getattr(senses[0], 'sememes', None):
-            sememe_map[word] = [s.sememe if hasattr(s, "sememe") else str(s) for s in senses[0].sememes]
-        else:
-            sememe_map[word] = []
-    return sememe_map
+        sememe_map[word] = sememes or ()
+    return tuple(sememe_map.items())
+
+_cached_word_sememes = lru_cache(maxsize=WORD_CACHE_SIZE)(_lookup_word_sememes)
+_cached_sentence_sememes = None
+
+def configure_sememe_cache(word_cache_size=WORD_CACHE_SIZE, sentence_cache_size=SENTENCE_CACHE_SIZE):
+    global _cached_word_sememes, _cached_sentence_sememes
+    _cached_word_sememes = lru_cache(maxsize=word_cache_size)(_lookup_word_sememes)
+    _cached_sentence_sememes = (
+        lru_cache(maxsize=sentence_cache_size)(_sememe_of_sentence_uncached) if sentence_cache_size else None
+    )
+
+def clear_sememe_cache(sentence_only=False):
+    if not sentence_only:
+        _cached_word_sememes.cache_clear()
+    if _cached_sentence_sememes is not None:
+        _cached_sentence_sememes.cache_clear()
+
+def sememe_cache_stats():
+    stats = {}
+    for name, cached in (("word", _cached_word_sememes), ("sentence", _cached_sentence_sememes)):
+        if cached is None:
+            continue
+        info = cached.cache_info()
+        total = info.hits + info.misses
+        stats[name] = {
+            "hits": info.hits,
+            "misses": info.misses,
+            "size": info.currsize,
+            "maxsize": info.maxsize,
+            "hit_rate": info.hits / total if total else 0.0,
+        }
+    return stats
+
+def sememe_of_sentence(sentence):
+    if _cached_sentence_sememes is not None:
+        items = _cached_sentence_sememes(sentence)
+    else:
+        items = _sememe_of_sentence_uncached(sentence)
+    return {word: list(sememes) for word, sememes in items}
 
 def get_sememe_tags(sentence):
     sememe_map = sememe_of_sentence(sentence)
@@ -100,12 +356,7 @@ def get_custom_synonym(sememe):
         key = sememe.split("|")[0]
     else:
         key = str(sememe)
-    entry = custom_synonyms.get(key)
-    if not entry:
-        for k, v in custom_synonyms.items():
-            if key in v.get("synonyms", []):
-                entry = v
-                break
+    entry = custom_synonyms.get(key) or _synonym_to_entry.get(key)
     if entry:
         main = entry.get("zh", key)
         alias = entry.get("synonyms", [])
@@ -116,7 +367,7 @@ def format_sememe_map(sememe_map, style="display", clean_for_vector=False, remov
     descriptions = []
     def clean_synonyms(synonyms):
         if remove_duplicates:
-            synonyms = list(set(synonyms))
+            synonyms = list(dict.fromkeys(synonyms))
         if sort_result:
             synonyms = sorted(synonyms)
         return synonyms
@@ -141,7 +392,7 @@ def format_sememe_map(sememe_map, style="display", clean_for_vector=False, remov
 def generate_augmented_query(question: str, sememe_map: dict, remove_duplicates=True, sort_result=True) -> str:
     def clean_synonyms(synonyms):
         if remove_duplicates:
-            synonyms = list(set(synonyms))
+            synonyms = list(dict.fromkeys(synonyms))
         if sort_result:
             synonyms = sorted(synonyms)
         return synonyms
@@ -163,14 +414,43 @@ def generate_augmented_query(question: str, sememe_map: dict, remove_duplicates=
 def set_custom_synonym_map(synonym_map):
     global custom_synonym_map
     custom_synonym_map = synonym_map
+    clear_sememe_cache()
+
+# 反向索引：同義詞 → 所屬條目（與原線性掃描相同，取字典順序第一個符合者）
+def _build_synonym_index(synonyms):
+    index = {}
+    for entry in synonyms.values():
+        entry_synonyms = entry.get("synonyms", []) if isinstance(entry, dict) else []
+        if not isinstance(entry_synonyms, (list, tuple, set)):
+            continue
+        for synonym in entry_synonyms:
+            if isinstance(synonym, str):
+                index.setdefault(synonym, entry)
+    return index
+
+# 反向索引：義原 → 在 related_to 中列出它的義原集合
+def _build_reverse_relations(relations):
+    index = {}
+    for name, entry in relations.items():
+        for related in entry.get("related_to", []) if isinstance(entry, dict) else []:
+            index.setdefault(related, set()).add(name)
+    return index
+
+# 直接修改 custom_synonyms / custom_sememe_relations 內容後，呼叫此函式重建索引
+def rebuild_custom_indexes():
+    global _synonym_to_entry, _reverse_relations
+    _synonym_to_entry = _build_synonym_index(custom_synonyms)
+    _reverse_relations = _build_reverse_relations(custom_sememe_relations)
 
 def set_custom_synonyms(synonyms):
-    global custom_synonyms
+    global custom_synonyms, _synonym_to_entry
     custom_synonyms = synonyms
+    _synonym_to_entry = _build_synonym_index(synonyms)
 
 def set_custom_sememe_relations(relations):
-    global custom_sememe_relations
+    global custom_sememe_relations, _reverse_relations
     custom_sememe_relations = relations
+    _reverse_relations = _build_reverse_relations(relations)
 
 def load_custom_sememe_data(path):
     with open(path, "r", encoding="utf-8") as f:
@@ -178,17 +458,51 @@ def load_custom_sememe_data(path):
     set_custom_synonyms(data.get("synonyms", {}))
     set_custom_sememe_relations(data.get("sememe_relations", {}))
 
+# ---- 編譯後的本體檔（由 check.compile_ontology_artifact 產生）----
+# 內容：正規化同義詞表、分類詞集合、各詞條分類結果與待嵌入文字；以魔術字串 + 版本號檢查後一次 unpickle
+ONTOLOGY_ARTIFACT_MAGIC = b"WAONTO01"
+ONTOLOGY_ARTIFACT_VERSION = 1
+
+def is_ontology_artifact(path):
+    if not os.path.isfile(path):
+        return False
+    with open(path, "rb") as f:
+        return f.read(len(ONTOLOGY_ARTIFACT_MAGIC)) == ONTOLOGY_ARTIFACT_MAGIC
+
+def write_ontology_artifact(artifact_path, artifact):
+    tmp_path = artifact_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(ONTOLOGY_ARTIFACT_MAGIC)
+        pickle.dump({**artifact, "version": ONTOLOGY_ARTIFACT_VERSION}, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, artifact_path)
+
+def load_ontology_artifact(artifact_path):
+    with open(artifact_path, "rb") as f:
+        if f.read(len(ONTOLOGY_ARTIFACT_MAGIC)) != ONTOLOGY_ARTIFACT_MAGIC:
+            raise ValueError(f"不是有效的本體編譯檔：{artifact_path}")
+        artifact = pickle.load(f)
+    if artifact.get("version") != ONTOLOGY_ARTIFACT_VERSION:
+        raise ValueError(
+            f"本體編譯檔版本不符：{artifact.get('version')}（需要 {ONTOLOGY_ARTIFACT_VERSION}），請重新執行 check.py"
+        )
+    return artifact
+
+# 載入編譯檔並套用 custom_synonym_map / custom_synonyms（取代重新壓平與分類）
+def load_custom_ontology(artifact_path):
+    artifact = load_ontology_artifact(artifact_path)
+    set_custom_synonym_map(artifact["synonym_map"])
+    set_custom_synonyms(artifact["entries"])
+    return artifact
+
 def get_related_sememes(sememe_name):
     entry = custom_sememe_relations.get(sememe_name)
     if not entry:
         return []
     related = set(entry.get("related_to", []))
-    for k, v in custom_sememe_relations.items():
-        if sememe_name in v.get("related_to", []):
-            related.add(k)
+    related.update(_reverse_relations.get(sememe_name, ()))
     return sorted(list(related))
 
 # 只在直接執行才顯示提示
 if __name__ == "__main__":
-    inject_all_hownet_words(verbose=True)
+    inject_all_hownet_words(verbose=True, cache_path="/content/jieba_hownet.cache")
     print("sememe_tools 完成初始化！")
@@ -0,0 +1,104 @@
+# 天氣再分類（reclassify_weather_terms）與原本逐詞掃描分類集合的結果一致性
+import copy
+import json
+import os
+import random
+
+import pytest
+
+import check
+
+ONTOLOGY_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "sememe_synonym_OK.json")
+
+CATEGORY_IDS = [
+    "geo-x", "pol-x", "tour-x", "tw-city-direct-x", "tw-climate-type-x", "tw-weather-rain-x", "soc-x",
+]
+FILLERS = ["過境", "特報", "區", "山", "夜", "天", "觀測", "影響"]
+
+
+# 原本的做法：原分類為 category_term_sets 中第一個含該詞的分類，逐一比對 WEATHER_OVERRIDE
+def reference_reclassify(category_term_sets, classified_terms):
+    reclassified_terms = []
+    for word in list(classified_terms):
+        original = None
+        for cat, terms in category_term_sets.items():
+            if word in terms:
+                original = cat
+                break
+        if any(keyword in word for keyword in check.WEATHER_OVERRIDE):
+            if word not in check.CLIMATE_EXCLUDE_FROM_WEATHER and original != "weather":
+                if original:
+                    category_term_sets[original].remove(word)
+                category_term_sets["weather"].add(word)
+                reclassified_terms.append((word, original, "weather"))
+    return reclassified_terms
+
+
+def reclassify_both(entries):
+    _, category_term_sets, classified_terms, _, word_categories = check.classify_entries(entries)
+    expected_sets = copy.deepcopy(category_term_sets)
+    expected = reference_reclassify(expected_sets, classified_terms)
+    actual = check.reclassify_weather_terms(category_term_sets, classified_terms, word_categories)
+    return actual, expected, category_term_sets, expected_sets
+
+
+def entry(zh, category_id):
+    return zh, {"zh": zh, "categories": [category_id]}
+
+
+def test_multi_category_override_words(monkeypatch):
+    monkeypatch.setattr(check, "CLIMATE_EXCLUDE_FROM_WEATHER", ["雷擊區"])
+    entries = [
+        entry("冷鋒過境", "geo-x"),
+        entry("冷鋒過境", "tw-city-direct-x"),
+        entry("豪雨特報", "tw-weather-rain-x"),
+        entry("豪雨特報", "pol-x"),
+        entry("大雷雨", "tour-x"),
+        entry("大雷雨", "tw-climate-type-x"),
+        entry("雷擊區", "geo-x"),
+        entry("晴天", "tour-x"),
+    ]
+    actual, expected, category_term_sets, expected_sets = reclassify_both(entries)
+
+    assert sorted(actual) == [("冷鋒過境", "geo_feature", "weather"), ("大雷雨", "tourism", "weather")]
+    assert actual == expected
+    assert dict(category_term_sets) == dict(expected_sets)
+    # 只從第一個所屬分類移出，其他分類保持不變
+    assert "冷鋒過境" not in category_term_sets["geo_feature"]
+    assert "冷鋒過境" in category_term_sets["location"]
+    assert "豪雨特報" in category_term_sets["politics"]
+    assert "雷擊區" in category_term_sets["geo_feature"]
+
+
+@pytest.mark.parametrize("seed", range(200))
+def test_randomized_synthetic_ontologies(seed):
+    rng = random.Random(seed)
+    vocabulary = [
+        rng.choice(check.WEATHER_OVERRIDE + FILLERS) + rng.choice(FILLERS)
+        for _ in range(rng.randint(5, 30))
+    ]
+    entries = [entry(rng.choice(vocabulary), rng.choice(CATEGORY_IDS)) for _ in range(rng.randint(10, 80))]
+    actual, expected, category_term_sets, expected_sets = reclassify_both(entries)
+
+    assert actual == expected
+    assert dict(category_term_sets) == dict(expected_sets)
+
+
+def test_synthetic_ontologies_exercise_reclassification():
+    total = 0
+    for seed in range(200):
+        rng = random.Random(seed)
+        vocabulary = [rng.choice(check.WEATHER_OVERRIDE) + rng.choice(FILLERS) for _ in range(5)]
+        entries = [entry(rng.choice(vocabulary), rng.choice(CATEGORY_IDS)) for _ in range(20)]
+        total += len(reclassify_both(entries)[0])
+    assert total > 200
+
+
+def test_sememe_synonym_ontology():
+    with open(ONTOLOGY_PATH, "r", encoding="utf-8") as f:
+        flattened_data = check.flatten_sememe_data(json.load(f), keep_raw=False)
+    actual, expected, category_term_sets, expected_sets = reclassify_both(flattened_data)
+
+    assert len(actual) == 13
+    assert actual == expected
+    assert dict(category_term_sets) == dict(expected_sets)
@@ -0,0 +1,83 @@
+# 精簡義原詞典（SememeLexicon）與 HowNet 查詢結果的一致性
+import pytest
+
+import sememe_tools as st
+
+
+class FakeSememe:
+    def __init__(self, name):
+        self.sememe = name
+
+
+class FakeSense:
+    def __init__(self, zh_word, en_word, sememes):
+        self.zh_word = zh_word
+        self.en_word = en_word
+        self.sememes = [FakeSememe(name) for name in sememes]
+
+
+# 與 OpenHowNet.HowNetDict 相同：查詢表的鍵已 strip，get_sense 以原字串精確查詢
+class FakeHowNet:
+    def __init__(self, senses):
+        self.en_map = {}
+        self._senses = senses
+        self._by_word = {}
+        for sense in senses:
+            for word in (sense.zh_word, sense.en_word):
+                if word and word.strip():
+                    self._by_word.setdefault(word.strip(), []).append(sense)
+
+    def get_all_senses(self):
+        return list(self._senses)
+
+    def get_sense(self, word):
+        return list(self._by_word.get(word, []))
+
+
+SENSES = [
+    FakeSense("天气", "weather", ["weather|天气"]),
+    FakeSense("台北", "Taipei", ["place|地方", "capital|国都"]),
+    FakeSense("下雨", "rain", ["RainSnow|雨雪"]),
+    FakeSense("明天", "tomorrow", ["time|时间", "future|将"]),
+    FakeSense("明天", "future", ["future|将"]),               # 多義詞：只取第一個義項
+    FakeSense(" 温度 ", "temperature ", ["temperature|冷热"]),  # 前後空白
+    FakeSense("问题", "problem", []),                         # 第一個義項沒有義原
+    FakeSense("问题", "question", ["problem|问题"]),
+]
+
+
+@pytest.fixture
+def hownet(monkeypatch):
+    fake = FakeHowNet(SENSES)
+    monkeypatch.setattr(st, "_hownet", fake)
+    yield fake
+    st.set_sememe_lexicon(None)
+
+
+@pytest.fixture
+def lexicon(hownet, tmp_path):
+    st.build_sememe_lexicon(str(tmp_path / "sememe.lex"))
+    lexicon = st.SememeLexicon(str(tmp_path / "sememe.lex"))
+    yield lexicon
+    lexicon.close()
+
+
+def test_every_hownet_word_matches(lexicon):
+    assert st.compare_lexicon_with_hownet(lexicon) == []
+
+
+def test_words_are_stripped(lexicon):
+    assert lexicon.get("温度") == ("temperature|冷热",)
+    assert lexicon.get("temperature") == ("temperature|冷热",)
+    assert " 温度 " not in lexicon
+
+
+def test_first_sense_only(lexicon):
+    assert lexicon.get("明天") == ("time|时间", "future|将")
+    assert lexicon.get("问题") is None
+    assert lexicon.get("不存在") is None
+
+
+def test_sentence_analysis_matches(lexicon):
+    sentences = ["台北明天下雨吗", "明天的温度是多少", "天气问题", ""]
+    assert st.compare_lexicon_with_hownet(lexicon, words=[], sentences=sentences) == []
@@ -2,14 +2,273 @@
 
 import os
 import json
+import mmap
+import time
+import hashlib
+import threading
+import unicodedata
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
 import faiss
 import torch
 import numpy as np
 from tqdm import tqdm
-from sklearn.preprocessing import normalize
 from transformers import AutoTokenizer, AutoModel
 
+# 單一批次前向計算與池化
+def _encode_batch(encoded, model, device, pooling="cls"):
+    encoded = encoded.to(device)
+    with torch.no_grad():
+        output = model(**encoded)
+
+    if pooling == "cls":
+        embeddings = output.last_hidden_state[:, 0]
+    elif pooling == "mean":
+        mask = encoded["attention_mask"].unsqueeze(-1).expand(output.last_hidden_state.size()).float()
+        embeddings = torch.sum(output.last_hidden_state * mask, dim=1) / torch.clamp(mask.sum(1), min=1e-9)
+    else:
+        raise ValueError("pooling 必須是 'cls' 或 'mean'")
+    return embeddings.cpu()
+
+# 就地 L2 正規化（float32、不另配置整份矩陣）；零向量維持為零，結果與 sklearn normalize 相同
+def _l2_normalize_inplace(vectors):
+    norms = np.sqrt(np.einsum("ij,ij->i", vectors, vectors))
+    norms[norms == 0.0] = 1.0
+    vectors /= norms[:, np.newaxis]
+    return vectors
+
+# 依 token 長度排序，並以 max_tokens（批次長度 × 筆數）為上限打包批次
+def _build_length_buckets(lengths, max_tokens):
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i])
+    buckets, current = [], []
+    for i in order:
+        # 已依長度遞增排序，加入後的批次最長長度即為 lengths[i]
+        if current and lengths[i] * (len(current) + 1) > max_tokens:
+            buckets.append(current)
+            current = []
+        current.append(i)
+    if current:
+        buckets.append(current)
+    return buckets
+
+# ---- 多行程 CPU 編碼：每個 worker 各自持有一份模型 ----
+_worker_model = None
+_worker_tokenizer = None
+
+def _init_encode_worker(model_name, num_threads):
+    global _worker_model, _worker_tokenizer
+    torch.set_num_threads(num_threads)
+    _worker_tokenizer = AutoTokenizer.from_pretrained(model_name)
+    _worker_model = AutoModel.from_pretrained(model_name).eval()
+
+def _encode_worker_chunk(task):
+    start, chunk, pooling, max_length, batch_size, max_tokens = task
+    embeddings = encode_texts(
+        chunk,
+        _worker_model,
+        _worker_tokenizer,
+        torch.device("cpu"),
+        pooling,
+        normalize_vec=False,
+        max_length=max_length,
+        batch_size=batch_size,
+        max_tokens=max_tokens,
+    )
+    return start, embeddings.astype(np.float32, copy=False)
+
+# 建立編碼用行程池（spawn），每個 worker 載入一次模型；可傳給 encode_texts(pool=...) 跨多次呼叫重複使用
+def create_encode_pool(model, num_workers, threads_per_worker=None):
+    model_name = getattr(model, "name_or_path", None)
+    if not model_name:
+        raise ValueError("多行程編碼需要可由 from_pretrained 載入的模型（model.name_or_path）")
+    if threads_per_worker is None:
+        threads_per_worker = max(1, (os.cpu_count() or 1) // num_workers)
+    ctx = multiprocessing.get_context("spawn")
+    return ctx.Pool(num_workers, initializer=_init_encode_worker, initargs=(model_name, threads_per_worker))
+
+def _encode_texts_multiprocess(
+    texts,
+    pool,
+    pooling="cls",
+    max_length=512,
+    batch_size=32,
+    max_tokens=None,
+    chunk_size=256,
+):
+    tasks = [
+        (start, texts[start : start + chunk_size], pooling, max_length, batch_size, max_tokens)
+        for start in range(0, len(texts), chunk_size)
+    ]
+
+    all_embeddings = None
+    # 各分片完成即寫回同一個 float32 矩陣
+    for start, embeddings in pool.imap_unordered(_encode_worker_chunk, tasks):
+        if all_embeddings is None:
+            all_embeddings = np.empty((len(texts), embeddings.shape[1]), dtype=np.float32)
+        all_embeddings[start : start + len(embeddings)] = embeddings
+    return all_embeddings
+
+# ---- 內容定址的向量快取（磁碟、可 mmap） ----
+# 以 (模型名稱, pooling, max_length, 正規化文字) 的雜湊為鍵，儲存未正規化的原始向量。
+# 快取由只附加的分段組成，flush 只寫出新增的一段，不重寫既有資料：
+#   seg_XXXXXX.keys.npy     (n, 20) uint8，sha1 鍵（最後寫入，存在即代表該段完整）
+#   seg_XXXXXX.vectors.npy  (n, D) float32，以 mmap 讀取
+#   seg_XXXXXX.ticks.npy    (n,) int64 最近使用時間，只重寫有命中的分段
+# 項目超過 max_entries 或分段超過 max_segments 時由 compact 逐段合併並淘汰最久未使用者
+class EmbeddingCache:
+    def __init__(self, cache_dir, max_entries=1_000_000, max_segments=32):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.max_segments = max_segments
+        self._segments = []
+        self._row_of = {}
+        self._pending = {}
+        self._dirty = set()
+        self._tick = 0
+        self._next_segment = 0
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        self._load()
+
+    def _path(self, name):
+        return os.path.join(self.cache_dir, name)
+
+    def _segment_path(self, segment_id, name):
+        return self._path(f"seg_{segment_id:06d}.{name}.npy")
+
+    def _load(self):
+        segment_ids = sorted(
+            int(name[4:10]) for name in os.listdir(self.cache_dir)
+            if name.startswith("seg_") and name.endswith(".keys.npy")
+        )
+        self._segments = []
+        self._row_of = {}
+        self._dirty = set()
+        self._next_segment = 0
+        for segment_id in segment_ids:
+            self._register_segment(segment_id, np.load(self._segment_path(segment_id, "keys")))
+        self._tick = max((int(ticks.max()) + 1 for _, _, ticks in self._segments if len(ticks)), default=0)
+
+    def _register_segment(self, segment_id, keys):
+        vectors = np.load(self._segment_path(segment_id, "vectors"), mmap_mode="r")
+        ticks = np.load(self._segment_path(segment_id, "ticks"))
+        seg = len(self._segments)
+        self._segments.append((segment_id, vectors, ticks))
+        raw_keys = keys.tobytes()
+        for row in range(len(keys)):
+            # 壓縮中斷時新舊分段可能重複，以先出現者為準
+            self._row_of.setdefault(raw_keys[row * 20 : (row + 1) * 20], (seg, row))
+        self._next_segment = segment_id + 1
+
+    @staticmethod
+    def make_key(model_name, pooling, max_length, text):
+        text = unicodedata.normalize("NFC", text).strip()
+        raw = json.dumps([model_name, pooling, max_length, text], ensure_ascii=False)
+        return hashlib.sha1(raw.encode("utf-8")).digest()
+
+    def __len__(self):
+        return len(self._row_of) + len(self._pending)
+
+    def get(self, key):
+        self._tick += 1
+        if key in self._pending:
+            self.hits += 1
+            return self._pending[key]
+        location = self._row_of.get(key)
+        if location is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        seg, row = location
+        _, vectors, ticks = self._segments[seg]
+        ticks[row] = self._tick
+        self._dirty.add(seg)
+        return vectors[row]
+
+    def put(self, key, vector):
+        if key not in self._row_of:
+            self._pending[key] = np.asarray(vector, dtype=np.float32)
+
+    @staticmethod
+    def _save_atomic(path, array):
+        tmp_path = path[: -len(".npy")] + ".tmp.npy"
+        np.save(tmp_path, array)
+        os.replace(tmp_path, path)
+
+    # 新向量寫成一個新分段，並只回寫有命中的分段 ticks（os.replace 保證檔案完整）
+    def _write_pending(self):
+        for seg in sorted(self._dirty):
+            segment_id, _, ticks = self._segments[seg]
+            self._save_atomic(self._segment_path(segment_id, "ticks"), ticks)
+        self._dirty = set()
+        if self._pending:
+            new_vectors = np.stack(list(self._pending.values())).astype(np.float32, copy=False)
+            if self._segments and self._segments[0][1].shape[1] != new_vectors.shape[1]:
+                raise ValueError("快取向量維度不一致，請為不同模型使用不同的 cache_dir")
+            new_keys = np.frombuffer(b"".join(self._pending.keys()), dtype=np.uint8).reshape(-1, 20)
+            segment_id = self._next_segment
+            self._save_atomic(self._segment_path(segment_id, "vectors"), new_vectors)
+            self._save_atomic(self._segment_path(segment_id, "ticks"), np.full(len(new_keys), self._tick, dtype=np.int64))
+            self._save_atomic(self._segment_path(segment_id, "keys"), new_keys)
+            self._register_segment(segment_id, new_keys)
+            self._pending = {}
+
+    def flush(self):
+        self._write_pending()
+        if len(self._row_of) > self.max_entries or len(self._segments) > self.max_segments:
+            self.compact()
+
+    # 合併所有分段為一段，保留最近使用的 max_entries 筆；逐段複製到 mmap 輸出，不把整個快取載入記憶體
+    def compact(self, block_rows=65536):
+        self._write_pending()
+        if not self._segments:
+            return
+        locations = sorted(self._row_of.values())
+        all_ticks = np.array([self._segments[seg][2][row] for seg, row in locations], dtype=np.int64)
+        keep = np.arange(len(locations))
+        if len(keep) > self.max_entries:
+            keep = np.sort(np.argsort(-all_ticks, kind="stable")[: self.max_entries])
+        key_of = {location: key for key, location in self._row_of.items()}
+        kept = [locations[i] for i in keep]
+
+        segment_id = self._next_segment
+        dim = self._segments[0][1].shape[1]
+        vectors_tmp = self._segment_path(segment_id, "vectors")[: -len(".npy")] + ".tmp.npy"
+        out = np.lib.format.open_memmap(vectors_tmp, mode="w+", dtype=np.float32, shape=(len(kept), dim))
+        rows_of = {}
+        for seg, row in kept:
+            rows_of.setdefault(seg, []).append(row)
+        offset = 0
+        for seg, (_, vectors, _) in enumerate(self._segments):
+            rows = rows_of.get(seg, [])
+            for i in range(0, len(rows), block_rows):
+                block = rows[i : i + block_rows]
+                out[offset : offset + len(block)] = vectors[block]
+                offset += len(block)
+        out.flush()
+        del out
+        os.replace(vectors_tmp, self._segment_path(segment_id, "vectors"))
+        self._save_atomic(self._segment_path(segment_id, "ticks"), all_ticks[keep])
+        new_keys = np.frombuffer(b"".join(key_of[location] for location in kept), dtype=np.uint8).reshape(-1, 20)
+        self._save_atomic(self._segment_path(segment_id, "keys"), new_keys)
+
+        old_ids = [old_id for old_id, _, _ in self._segments]
+        self._segments = []
+        for old_id in old_ids:
+            for name in ("keys", "vectors", "ticks"):
+                os.remove(self._segment_path(old_id, name))
+        self._load()
+
 # 文字向量編碼
+# max_tokens 設定時改用長度分桶模式：依 token 長度排序，每批 padding 後的 token 數不超過 max_tokens，
+# 輸出仍維持原始順序（此模式下忽略 batch_size）；None 則為固定 batch_size 切分
+# num_workers > 1 時將文字分片給 CPU 行程池，每個 worker 依 model.name_or_path 載入自己的模型，
+# 並以 threads_per_worker 固定 intra-op 執行緒數（預設為 CPU 核心數 / num_workers）；
+# pool 為 create_encode_pool 建立的行程池時直接使用（忽略 num_workers），避免每次呼叫都重新載入模型
+# cache 為 EmbeddingCache 時只有未命中的文字會送進模型，結束後寫回磁碟
+# deduplicate=True 時相同文字只編碼一次，再依原始順序展開
 def encode_texts(
     texts,
     model,
@@ -19,12 +278,95 @@ def encode_texts(
     normalize_vec=True,
     max_length=512,
     batch_size=32,
+    max_tokens=None,
+    num_workers=1,
+    threads_per_worker=None,
+    cache=None,
+    deduplicate=False,
+    pool=None,
 ):
     if isinstance(texts, str):
         texts = [texts]
 
-    all_embeddings = []
+    if deduplicate and len(texts) > 1:
+        unique_rows = {}
+        inverse = [unique_rows.setdefault(text, len(unique_rows)) for text in texts]
+        if len(unique_rows) < len(texts):
+            unique_embeddings = encode_texts(
+                list(unique_rows),
+                model,
+                tokenizer,
+                device,
+                pooling,
+                normalize_vec=normalize_vec,
+                max_length=max_length,
+                batch_size=batch_size,
+                max_tokens=max_tokens,
+                num_workers=num_workers,
+                threads_per_worker=threads_per_worker,
+                cache=cache,
+                pool=pool,
+            )
+            return unique_embeddings[inverse]
+
+    if cache is not None:
+        model_name = getattr(model, "name_or_path", None) or type(model).__name__
+        keys = [EmbeddingCache.make_key(model_name, pooling, max_length, text) for text in texts]
+        cached = [cache.get(key) for key in keys]
+        miss_rows = [i for i, vec in enumerate(cached) if vec is None]
+        if miss_rows:
+            miss_embeddings = encode_texts(
+                [texts[i] for i in miss_rows],
+                model,
+                tokenizer,
+                device,
+                pooling,
+                normalize_vec=False,
+                max_length=max_length,
+                batch_size=batch_size,
+                max_tokens=max_tokens,
+                num_workers=num_workers,
+                threads_per_worker=threads_per_worker,
+                pool=pool,
+            )
+            for row, vec in zip(miss_rows, miss_embeddings):
+                cached[row] = vec
+                cache.put(keys[row], vec)
+        cache.flush()
+        if not texts:
+            return np.zeros((0, model.config.hidden_size), dtype=np.float32)
+        all_embeddings = np.stack(cached).astype(np.float32, copy=False)
+        return _l2_normalize_inplace(all_embeddings) if normalize_vec else all_embeddings
+
+    if len(texts) > 1 and (pool is not None or (num_workers and num_workers > 1)):
+        kwargs = dict(pooling=pooling, max_length=max_length, batch_size=batch_size, max_tokens=max_tokens)
+        if pool is not None:
+            all_embeddings = _encode_texts_multiprocess(texts, pool, **kwargs)
+        else:
+            with create_encode_pool(model, num_workers, threads_per_worker) as own_pool:
+                all_embeddings = _encode_texts_multiprocess(texts, own_pool, **kwargs)
+        return _l2_normalize_inplace(all_embeddings) if normalize_vec else all_embeddings
+
+    if max_tokens:
+        if not texts:
+            return np.zeros((0, model.config.hidden_size), dtype=np.float32)
+        features = tokenizer(texts, truncation=True, max_length=max_length)
+        lengths = [len(ids) for ids in features["input_ids"]]
+        all_embeddings = None
+        for bucket in _build_length_buckets(lengths, max_tokens):
+            encoded = tokenizer.pad(
+                {key: [features[key][i] for i in bucket] for key in features.keys()},
+                padding=True,
+                return_tensors="pt",
+            )
+            embeddings = _encode_batch(encoded, model, device, pooling).numpy()
+            if all_embeddings is None:
+                all_embeddings = np.empty((len(texts), embeddings.shape[1]), dtype=np.float32)
+            all_embeddings[bucket] = embeddings
+        return _l2_normalize_inplace(all_embeddings) if normalize_vec else all_embeddings
 
+    # 各批次直接寫入預先配置的 float32 矩陣，不保留批次張量再串接
+    all_embeddings = None
     for i in range(0, len(texts), batch_size):
         batch_texts = texts[i : i + batch_size]
         encoded = tokenizer(
@@ -33,24 +375,191 @@ def encode_texts(
             truncation=True,
             max_length=max_length,
             return_tensors="pt",
-        ).to(device)
-        with torch.no_grad():
-            output = model(**encoded)
-
-        if pooling == "cls":
-            embeddings = output.last_hidden_state[:, 0]
-        elif pooling == "mean":
-            mask = encoded["attention_mask"].unsqueeze(-1).expand(output.last_hidden_state.size()).float()
-            embeddings = torch.sum(output.last_hidden_state * mask, dim=1) / torch.clamp(mask.sum(1), min=1e-9)
+        )
+        embeddings = _encode_batch(encoded, model, device, pooling).numpy()
+        if all_embeddings is None:
+            all_embeddings = np.empty((len(texts), embeddings.shape[1]), dtype=np.float32)
+        all_embeddings[i : i + len(batch_texts)] = embeddings
+    if all_embeddings is None:
+        return np.zeros((0, model.config.hidden_size), dtype=np.float32)
+    return _l2_normalize_inplace(all_embeddings) if normalize_vec else all_embeddings
+
+# ---- 分塊編碼 checkpoint：每 chunk_size 筆的向量各存成一個 .npy，可中斷續跑 ----
+# manifest 記錄輸入文字的雜湊與編碼參數，不一致時拒絕沿用舊區塊
+def encode_checkpoint_manifest(
+    texts, model, pooling="cls", max_tokens=None, chunk_size=4096, deduplicate=False, batch_size=32
+):
+    digest = hashlib.sha1()
+    for text in texts:
+        digest.update(text.encode("utf-8"))
+        digest.update(b"\0")
+    return {
+        "model": getattr(model, "name_or_path", None) or type(model).__name__,
+        "pooling": pooling,
+        "max_tokens": max_tokens,
+        "chunk_size": chunk_size,
+        "batch_size": batch_size,
+        "deduplicate": deduplicate,
+        "num_texts": len(texts),
+        "texts_sha1": digest.hexdigest(),
+    }
+
+def _encode_chunk_path(checkpoint_dir, start, end):
+    return os.path.join(checkpoint_dir, f"chunk_{start:09d}_{end:09d}.npy")
+
+# 依固定列範圍 [start, end) 分塊編碼；已存在的區塊直接載入。
+# deduplicate=True 時與 encode_texts 相同，先對全部文字去重，再將唯一文字切塊、最後依原始順序展開；
+# 固定批次模式（max_tokens=None）下 chunk_size 須為 batch_size 的倍數，區塊內的批次切分與一次跑完相同，
+# 因此中斷續跑與不使用 checkpoint 的建置逐位元相同。長度分桶模式的批次在各區塊內獨立組成，結果僅在數值誤差內一致。
+def encode_texts_checkpointed(
+    texts,
+    model,
+    tokenizer,
+    device,
+    checkpoint_dir,
+    chunk_size=4096,
+    pooling="cls",
+    max_tokens=None,
+    num_workers=1,
+    cache=None,
+    deduplicate=False,
+    silent=False,
+    batch_size=32,
+):
+    if not max_tokens and chunk_size % batch_size:
+        raise ValueError(f"chunk_size（{chunk_size}）必須是 batch_size（{batch_size}）的倍數")
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    manifest_path = os.path.join(checkpoint_dir, "manifest.json")
+    manifest = encode_checkpoint_manifest(texts, model, pooling, max_tokens, chunk_size, deduplicate, batch_size)
+    if os.path.exists(manifest_path):
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            if json.load(f) != manifest:
+                raise ValueError(f"checkpoint 與目前輸入或參數不一致，請清除 {checkpoint_dir} 後重跑")
+    else:
+        with open(manifest_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False)
+
+    inverse = None
+    if deduplicate and len(texts) > 1:
+        unique_rows = {}
+        inverse = [unique_rows.setdefault(text, len(unique_rows)) for text in texts]
+        if len(unique_rows) < len(texts):
+            texts = list(unique_rows)
         else:
-            raise ValueError("pooling 必須是 'cls' 或 'mean'")
+            inverse = None
 
-        all_embeddings.append(embeddings.cpu())
+    vectors = None
+    resumed = 0
+    # 多行程時整個階段共用一個行程池，worker 只載入一次模型；第一個需要編碼的區塊才建立
+    pool = None
+    try:
+        for start in tqdm(range(0, len(texts), chunk_size), desc="分塊編碼", disable=silent):
+            end = min(start + chunk_size, len(texts))
+            path = _encode_chunk_path(checkpoint_dir, start, end)
+            if os.path.exists(path):
+                chunk = np.load(path)
+                resumed += 1
+            else:
+                if pool is None and num_workers and num_workers > 1:
+                    pool = create_encode_pool(model, num_workers)
+                chunk = encode_texts(
+                    texts[start:end], model, tokenizer, device, pooling, batch_size=batch_size,
+                    max_tokens=max_tokens, cache=cache, pool=pool,
+                ).astype(np.float32, copy=False)
+                with open(path + ".tmp", "wb") as f:
+                    np.save(f, chunk)
+                os.replace(path + ".tmp", path)
+            if vectors is None:
+                vectors = np.empty((len(texts), chunk.shape[1]), dtype=np.float32)
+            vectors[start:end] = chunk
+    finally:
+        if pool is not None:
+            pool.terminate()
+    if resumed and not silent:
+        print(f"由 checkpoint 載入 {resumed} 個已完成的區塊：{checkpoint_dir}")
+    if vectors is None:
+        return np.zeros((0, model.config.hidden_size), dtype=np.float32)
+    return vectors[inverse] if inverse is not None else vectors
 
-    all_embeddings = torch.cat(all_embeddings, dim=0).numpy()
-    return normalize(all_embeddings) if normalize_vec else all_embeddings
+# ---- FAISS 索引類型 ----
+# flat：精確內積搜尋；ivf_flat / hnsw / ivf_pq：近似搜尋，IVF 類需先以樣本訓練
+INDEX_TYPES = ("flat", "ivf_flat", "hnsw", "ivf_pq")
+
+# 經驗值：約 4·sqrt(N)，並確保每個聚類至少有 39 筆訓練資料
+def _default_nlist(n_vectors):
+    return max(1, min(int(4 * np.sqrt(n_vectors)), n_vectors // 39))
+
+# 向量儲存精度：float32 原始向量、float16（SQfp16，記憶體減半）、int8（SQ8，每維 1 byte，需訓練各維範圍）
+INDEX_PRECISIONS = {"float32": "Flat", "float16": "SQfp16", "int8": "SQ8"}
+
+def _index_factory_string(index_type, n_vectors, nlist=None, hnsw_m=32, pq_m=16, pq_nbits=8, precision="float32"):
+    if precision not in INDEX_PRECISIONS:
+        raise ValueError(f"precision 必須是 {tuple(INDEX_PRECISIONS)} 之一")
+    storage = INDEX_PRECISIONS[precision]
+    if nlist is None:
+        nlist = _default_nlist(n_vectors)
+    if index_type == "flat":
+        return storage
+    if index_type == "ivf_flat":
+        return f"IVF{nlist},{storage}"
+    if index_type == "hnsw":
+        return f"HNSW{hnsw_m}" if precision == "float32" else f"HNSW{hnsw_m},{storage}"
+    if index_type == "ivf_pq":
+        if precision != "float32":
+            raise ValueError("ivf_pq 已使用乘積量化，不支援 precision 設定")
+        return f"IVF{nlist},PQ{pq_m}x{pq_nbits}"
+    raise ValueError(f"index_type 必須是 {INDEX_TYPES} 之一")
+
+def _needs_training(index_type, precision="float32"):
+    return index_type in ("ivf_flat", "ivf_pq") or precision == "int8"
+
+# 依 index_type 建立（必要時訓練）內積索引並加入向量
+# ids 不為 None 時以 IndexIDMap2 包裝並使用指定的 int64 id
+def build_faiss_index(
+    vectors,
+    index_type="flat",
+    ids=None,
+    nlist=None,
+    hnsw_m=32,
+    pq_m=16,
+    pq_nbits=8,
+    ef_construction=None,
+    train_size=100_000,
+    seed=42,
+    precision="float32",
+):
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    factory = _index_factory_string(index_type, len(vectors), nlist, hnsw_m, pq_m, pq_nbits, precision)
+    index = faiss.index_factory(vectors.shape[1], factory, faiss.METRIC_INNER_PRODUCT)
+    if index_type == "hnsw" and ef_construction:
+        index.hnsw.efConstruction = ef_construction
+    if not index.is_trained:
+        # 只取樣本訓練量化器，避免大語料訓練成本隨資料量成長
+        if len(vectors) > train_size:
+            sample = np.random.default_rng(seed).choice(len(vectors), train_size, replace=False)
+            index.train(vectors[np.sort(sample)])
+        else:
+            index.train(vectors)
+    if ids is not None:
+        index = faiss.IndexIDMap2(index)
+        index.add_with_ids(vectors, np.asarray(ids, dtype=np.int64))
+    else:
+        index.add(vectors)
+    return index
+
+# 查詢期參數：IVF 類設定 nprobe，HNSW 設定 efSearch（不適用的參數略過）
+def set_search_params(index, nprobe=None, ef_search=None):
+    base = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap) else index
+    params = faiss.ParameterSpace()
+    if nprobe is not None and faiss.try_extract_index_ivf(base) is not None:
+        params.set_index_parameter(index, "nprobe", nprobe)
+    if ef_search is not None and isinstance(base, faiss.IndexHNSW):
+        params.set_index_parameter(index, "efSearch", ef_search)
+    return index
 
 # FAISS 向量庫操作
+# index_type 可為 INDEX_TYPES 之一，precision 為 INDEX_PRECISIONS 之一（ivf_pq 固定 float32）；
+# 增量模式需支援 remove_ids 與 reconstruct，僅支援 float32 flat
 def build_faiss_index_and_save(
     texts,
     ids,
@@ -60,14 +569,208 @@ def build_faiss_index_and_save(
     device,
     index_path,
     meta_path,
-    pooling="cls"
+    pooling="cls",
+    max_tokens=None,
+    num_workers=1,
+    cache=None,
+    incremental=False,
+    compact_ratio=0.3,
+    index_type="flat",
+    nlist=None,
+    hnsw_m=32,
+    pq_m=16,
+    train_size=100_000,
+    deduplicate=False,
+    vectors=None,
+    streaming=False,
+    precision="float32",
+    silent=False
+):
+    if streaming:
+        if incremental or cache is not None or vectors is not None:
+            raise ValueError("串流模式不支援 incremental / cache / vectors")
+        return stream_build_faiss_index_and_save(
+            texts, ids, meta_list, model, tokenizer, device, index_path, meta_path, pooling=pooling,
+            max_tokens=max_tokens, index_type=index_type, nlist=nlist, hnsw_m=hnsw_m, pq_m=pq_m,
+            train_size=train_size, deduplicate=deduplicate, precision=precision, silent=silent,
+        )
+    if incremental and (index_type != "flat" or precision != "float32"):
+        raise ValueError("增量模式目前僅支援 index_type='flat'、precision='float32'")
+    if incremental and vectors is not None:
+        raise ValueError("增量模式會自行比對並編碼變動資料，不接受預先編碼的 vectors")
+    if incremental and os.path.exists(index_path) and os.path.exists(meta_path):
+        return update_faiss_index_and_save(
+            texts, ids, meta_list, model, tokenizer, device, index_path, meta_path,
+            pooling=pooling, max_tokens=max_tokens, num_workers=num_workers, cache=cache,
+            compact_ratio=compact_ratio, deduplicate=deduplicate,
+        )
+
+    # vectors：預先編碼好的向量（與 texts 同序，例如 encode_texts_checkpointed 的結果），提供時略過編碼
+    if vectors is None:
+        vectors = encode_texts(
+            texts, model, tokenizer, device, pooling, max_tokens=max_tokens, num_workers=num_workers, cache=cache,
+            deduplicate=deduplicate,
+        )
+    # 增量模式以 IndexIDMap2 儲存，FAISS id 即為 metadata 的行號
+    index = build_faiss_index(
+        vectors,
+        index_type=index_type,
+        ids=np.arange(len(vectors), dtype=np.int64) if incremental else None,
+        nlist=nlist,
+        hnsw_m=hnsw_m,
+        pq_m=pq_m,
+        train_size=train_size,
+        precision=precision,
+    )
+    faiss.write_index(index, index_path)
+    _write_metadata(meta_path, ids, texts, meta_list)
+    print(f"儲存完成：{index_path}, {meta_path}")
+
+# 串流建置：每次只編碼 window_size 筆，就地正規化後立即加入索引並寫出對應的 metadata 列，
+# 記憶體峰值與視窗大小相關而非語料大小（索引本身除外）。需訓練的索引先累積前 train_size 筆訓練，
+# nlist 預設依全體筆數計算。去重只在視窗內進行；不支援 cache 與多行程編碼
+def stream_build_faiss_index_and_save(
+    texts,
+    ids,
+    meta_list,
+    model,
+    tokenizer,
+    device,
+    index_path,
+    meta_path,
+    pooling="cls",
+    max_tokens=None,
+    window_size=1024,
+    batch_size=32,
+    index_type="flat",
+    nlist=None,
+    hnsw_m=32,
+    pq_m=16,
+    train_size=100_000,
+    deduplicate=False,
+    silent=False,
+    precision="float32",
 ):
-    vectors = encode_texts(texts, model, tokenizer, device, pooling)
-    index = faiss.IndexFlatIP(vectors.shape[1])
-    index.add(vectors)
+    if nlist is None and index_type in ("ivf_flat", "ivf_pq"):
+        nlist = _default_nlist(len(texts))
+    needs_training = _needs_training(index_type, precision)
+    index = None
+    pending = []
+
+    def add(vectors):
+        nonlocal index
+        if index is None:
+            index = build_faiss_index(
+                vectors, index_type=index_type, nlist=nlist, hnsw_m=hnsw_m, pq_m=pq_m, train_size=train_size,
+                precision=precision,
+            )
+        else:
+            index.add(vectors)
+
+    def records():
+        for start in tqdm(range(0, len(texts), window_size), desc="串流編碼並加入索引", disable=silent):
+            end = min(start + window_size, len(texts))
+            vectors = encode_texts(
+                texts[start:end], model, tokenizer, device, pooling, normalize_vec=False, batch_size=batch_size,
+                max_tokens=max_tokens, deduplicate=deduplicate,
+            )
+            vectors = _l2_normalize_inplace(np.ascontiguousarray(vectors, dtype=np.float32))
+            if needs_training and index is None:
+                pending.append(vectors)
+                if sum(len(v) for v in pending) >= min(train_size, len(texts)):
+                    add(np.concatenate(pending))
+                    pending.clear()
+            else:
+                add(vectors)
+            for i in range(start, end):
+                yield {"id": ids[i], "text": texts[i], "meta": meta_list[i]}
+        if pending:
+            add(np.concatenate(pending))
+            pending.clear()
+
+    if is_metadata_store(meta_path):
+        write_metadata_store(meta_path, records())
+    else:
+        with open(meta_path, "w", encoding="utf-8") as f:
+            for record in records():
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    if index is None:
+        index = faiss.IndexFlatIP(model.config.hidden_size)
     faiss.write_index(index, index_path)
+    print(f"儲存完成：{index_path}, {meta_path}")
+
+# ---- 二進位 metadata 儲存：mmap + 位移索引，只解碼 FAISS 回傳的列 ----
+# 檔案格式：MAGIC | 各列 UTF-8 JSON | offsets (N+1) uint64 | N uint64 | MAGIC
+METADATA_STORE_MAGIC = b"WAMETA01"
+
+def is_metadata_store(path):
+    if os.path.exists(path):
+        with open(path, "rb") as f:
+            return f.read(len(METADATA_STORE_MAGIC)) == METADATA_STORE_MAGIC
+    return path.endswith(".bin")
+
+def _write_metadata_store_rows(store_path, rows):
+    offsets = [len(METADATA_STORE_MAGIC)]
+    tmp_path = store_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(METADATA_STORE_MAGIC)
+        for row in rows:
+            f.write(row)
+            offsets.append(offsets[-1] + len(row))
+        f.write(np.asarray(offsets, dtype="<u8").tobytes())
+        f.write(np.asarray([len(offsets) - 1], dtype="<u8").tobytes())
+        f.write(METADATA_STORE_MAGIC)
+    os.replace(tmp_path, store_path)
+    return len(offsets) - 1
+
+def write_metadata_store(store_path, records):
+    return _write_metadata_store_rows(
+        store_path, (json.dumps(record, ensure_ascii=False).encode("utf-8") for record in records)
+    )
+
+# 一次性轉換：既有 metadata.jsonl ➜ 二進位 metadata 儲存（逐行串流，不整份載入）
+def convert_jsonl_to_metadata_store(jsonl_path, store_path):
+    with open(jsonl_path, "rb") as f:
+        count = _write_metadata_store_rows(store_path, (line.strip() for line in f if line.strip()))
+    print(f"轉換完成：{jsonl_path} ➜ {store_path}，共 {count} 筆")
+    return count
 
-    with open(meta_path, "w", encoding="utf-8") as f:
+# 唯讀 metadata 儲存：行為同 list（len / 索引 / 迭代），存取時才解碼該列
+class MetadataStore:
+    def __init__(self, store_path):
+        self.store_path = store_path
+        with open(store_path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic_size = len(METADATA_STORE_MAGIC)
+        if self._mm[:magic_size] != METADATA_STORE_MAGIC or self._mm[-magic_size:] != METADATA_STORE_MAGIC:
+            raise ValueError(f"不是有效的 metadata 儲存檔：{store_path}")
+        count_offset = len(self._mm) - magic_size - 8
+        count = int(np.frombuffer(self._mm, dtype="<u8", count=1, offset=count_offset)[0])
+        self._offsets = np.frombuffer(self._mm, dtype="<u8", count=count + 1, offset=count_offset - 8 * (count + 1))
+        self._count = count
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, row):
+        # 不接受負列號：FAISS 以 -1 表示「無結果」，不可被解讀為最後一列
+        row = int(row)
+        if not 0 <= row < self._count:
+            raise IndexError(f"metadata 列號超出範圍：{row}")
+        start, end = int(self._offsets[row]), int(self._offsets[row + 1])
+        return json.loads(self._mm[start:end].decode("utf-8"))
+
+    def __iter__(self):
+        for row in range(self._count):
+            yield self[row]
+
+def _write_metadata(meta_path, ids, texts, meta_list, mode="w"):
+    if mode == "w" and is_metadata_store(meta_path):
+        write_metadata_store(
+            meta_path, ({"id": ids[i], "text": texts[i], "meta": meta} for i, meta in enumerate(meta_list))
+        )
+        return
+    with open(meta_path, mode, encoding="utf-8") as f:
         for i, meta in enumerate(meta_list):
             meta_record = {
                 "id": ids[i],
@@ -75,14 +778,216 @@ def build_faiss_index_and_save(
                 "meta": meta,
             }
             f.write(json.dumps(meta_record, ensure_ascii=False) + "\n")
-    print(f"儲存完成：{index_path}, {meta_path}")
 
-def load_index_and_metadata(index_path, meta_path):
-    index = faiss.read_index(index_path)
+# 取得 IndexIDMap2 目前有效的 FAISS id；一般索引則視為 0..ntotal-1
+def _live_ids(index):
+    if isinstance(index, faiss.IndexIDMap):
+        return faiss.vector_to_array(index.id_map).astype(np.int64)
+    return np.arange(index.ntotal, dtype=np.int64)
+
+# 將一般索引轉為以行號為 id 的 IndexIDMap2（需可 reconstruct）
+def _to_id_map(index):
+    if isinstance(index, faiss.IndexIDMap2):
+        return index
+    vectors = index.reconstruct_n(0, index.ntotal)
+    id_map = faiss.IndexIDMap2(faiss.IndexFlatIP(index.d))
+    id_map.add_with_ids(vectors, np.arange(index.ntotal, dtype=np.int64))
+    return id_map
+
+# 增量更新：比對 (id, text, meta) 與既有索引，只編碼未見過的文字；文字相同者沿用舊向量
+#   - 新增 / 文字變動：編碼後以新行號 add_with_ids，metadata 附加寫入
+#   - 僅 meta 變動：沿用既有向量，改以新行號重新加入
+#   - 已刪除：remove_ids，metadata 行保留為失效行
+# 失效行比例超過 compact_ratio 時整理（重新編號並重寫 metadata）
+def update_faiss_index_and_save(
+    texts,
+    ids,
+    meta_list,
+    model,
+    tokenizer,
+    device,
+    index_path,
+    meta_path,
+    pooling="cls",
+    max_tokens=None,
+    num_workers=1,
+    cache=None,
+    compact_ratio=0.3,
+    deduplicate=False
+):
+    index, metadata = load_index_and_metadata(index_path, meta_path)
+    index = _to_id_map(index)
+    # 二進位儲存無法附加寫入，建置期整份解碼後於結尾重寫
+    binary_store = isinstance(metadata, MetadataStore)
+    if binary_store:
+        metadata = list(metadata)
+
+    live_rows = {metadata[row]["id"]: int(row) for row in _live_ids(index)}
+    text_rows = {metadata[row]["text"]: row for row in live_rows.values()}
+
+    # 文字未變者沿用舊向量（即使 id 或列位置改變）；只有未見過的文字需要編碼
+    to_encode, to_move, kept_rows, reused = [], [], set(), 0
+    for i, key in enumerate(ids):
+        row = live_rows.get(key)
+        if row is not None and metadata[row]["text"] == texts[i]:
+            if metadata[row]["meta"] == meta_list[i]:
+                kept_rows.add(row)
+            else:
+                to_move.append((i, row))
+        elif texts[i] in text_rows:
+            to_move.append((i, text_rows[texts[i]]))
+            reused += 1
+        else:
+            to_encode.append(i)
+
+    moved_vectors = [index.reconstruct(row) for _, row in to_move]
+    drop = np.array([row for row in live_rows.values() if row not in kept_rows], dtype=np.int64)
+    if len(drop):
+        index.remove_ids(drop)
+
+    append_rows = to_encode + [i for i, _ in to_move]
+    if append_rows:
+        vectors = []
+        if to_encode:
+            vectors.append(encode_texts(
+                [texts[i] for i in to_encode], model, tokenizer, device, pooling,
+                max_tokens=max_tokens, num_workers=num_workers, cache=cache, deduplicate=deduplicate,
+            ))
+        if moved_vectors:
+            vectors.append(np.stack(moved_vectors))
+        vectors = np.concatenate(vectors, axis=0).astype(np.float32, copy=False)
+        start = len(metadata)
+        index.add_with_ids(vectors, np.arange(start, start + len(append_rows), dtype=np.int64))
+        if not binary_store:
+            _write_metadata(
+                meta_path,
+                [ids[i] for i in append_rows],
+                [texts[i] for i in append_rows],
+                [meta_list[i] for i in append_rows],
+                mode="a",
+            )
+        metadata.extend({"id": ids[i], "text": texts[i], "meta": meta_list[i]} for i in append_rows)
+
+    dead = len(metadata) - index.ntotal
+    if metadata and dead / len(metadata) > compact_ratio:
+        index, metadata = compact_index_and_metadata(index, metadata, meta_path)
+    elif binary_store and append_rows:
+        write_metadata_store(meta_path, metadata)
+    faiss.write_index(index, index_path)
+
+    new_ids = set(ids)
+    stats = {
+        "added": len(new_ids - live_rows.keys()),
+        "updated": len(new_ids & live_rows.keys()) - len(kept_rows),
+        "removed": len(live_rows.keys() - new_ids),
+        "unchanged": len(kept_rows),
+        "encoded": len(to_encode),
+        "reused": reused,
+    }
+    print(f"增量更新完成：{index_path}, {meta_path}｜{stats}")
+    return stats
+
+# 依 FAISS id 順序整理：移除失效的 metadata 行並重新編號為 0..n-1
+def compact_index_and_metadata(index, metadata, meta_path):
+    live = np.sort(_live_ids(index))
+    vectors = np.stack([index.reconstruct(int(row)) for row in live]) if len(live) else None
+    compacted = faiss.IndexIDMap2(faiss.IndexFlatIP(index.d))
+    if vectors is not None:
+        compacted.add_with_ids(vectors, np.arange(len(live), dtype=np.int64))
+    metadata = [metadata[row] for row in live]
+    _write_metadata(
+        meta_path,
+        [record["id"] for record in metadata],
+        [record["text"] for record in metadata],
+        [record["meta"] for record in metadata],
+    )
+    return compacted, metadata
+
+def load_index_and_metadata(index_path, meta_path, nprobe=None, ef_search=None):
+    index = set_search_params(faiss.read_index(index_path), nprobe=nprobe, ef_search=ef_search)
+    if is_metadata_store(meta_path):
+        return index, MetadataStore(meta_path)
     with open(meta_path, "r", encoding="utf-8") as f:
         metadata = [json.loads(line.strip()) for line in f]
     return index, metadata
 
+# ---- 查詢向量 LRU / TTL 快取 ----
+# 以 (模型名稱, pooling, 正規化查詢) 為鍵；預設正規化為 sememe_tools.normalize_text（繁簡轉換、台/臺統一）
+def _default_query_normalizer(query):
+    import sememe_tools as st  # 延遲載入，避免 import 本模組時初始化 HowNet
+    return st.normalize_text(query.strip())
+
+class QueryEmbeddingCache:
+    def __init__(self, max_size=1024, ttl=None, normalizer=_default_query_normalizer):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.normalizer = normalizer
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def make_key(self, query, model, pooling):
+        model_name = getattr(model, "name_or_path", None) or type(model).__name__
+        return (model_name, pooling, self.normalizer(query) if self.normalizer else query)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.ttl is not None and time.monotonic() - entry[1] > self.ttl:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    # 存入獨立副本：批次編碼的列是整個批次矩陣的檢視，直接保存會讓每筆快取都拖住整個批次
+    def put(self, key, vector):
+        vector = np.array(vector, dtype=np.float32, copy=True)
+        with self._lock:
+            self._entries[key] = (vector, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+# 查詢編碼：有 query_cache 時只編碼未命中的查詢
+def encode_queries(queries, model, tokenizer, device, pooling="cls", query_cache=None, batch_size=32):
+    if isinstance(queries, str):
+        queries = [queries]
+    if query_cache is None:
+        return encode_texts(queries, model, tokenizer, device, pooling, batch_size=batch_size)
+
+    keys = [query_cache.make_key(query, model, pooling) for query in queries]
+    vectors = [query_cache.get(key) for key in keys]
+    miss_rows = [i for i, vec in enumerate(vectors) if vec is None]
+    if miss_rows:
+        miss_vectors = encode_texts(
+            [queries[i] for i in miss_rows], model, tokenizer, device, pooling, batch_size=batch_size
+        )
+        for row, vec in zip(miss_rows, miss_vectors):
+            vectors[row] = vec
+            query_cache.put(keys[row], vec)
+    return np.stack(vectors).astype(np.float32, copy=False)
+
 # 基礎搜尋
 def search_with_metadata(
     query,
@@ -92,30 +997,23 @@ def search_with_metadata(
     tokenizer,
     device,
     topk=5,
-    pooling="cls"
+    pooling="cls",
+    query_cache=None
 ):
-    q_vec = encode_texts(query, model, tokenizer, device, pooling)
+    q_vec = encode_queries(query, model, tokenizer, device, pooling, query_cache)
     D, I = index.search(q_vec, topk)
+    # IVF / HNSW 候選不足時以 -1 補位，略過
     return [
         {
             "score": float(D[0][i]),
             **metadata[idx],
         }
         for i, idx in enumerate(I[0])
+        if idx >= 0
     ]
 
-# 合併多個資料庫搜尋
-def combine_search(
-    query,
-    indices_and_metadata=None,
-    indices=None,
-    metadatas=None,
-    model=None,
-    tokenizer=None,
-    device=None,
-    topk=5,
-    pooling="cls"
-):
+# 檢查並統一 combine_search 系列的索引參數格式
+def _resolve_indices(indices_and_metadata=None, indices=None, metadatas=None):
     if indices_and_metadata:
         if not isinstance(indices_and_metadata, list):
             raise ValueError("indices_and_metadata 必須是 [(index, metadata), ...] 格式")
@@ -126,24 +1024,79 @@ def combine_search(
             raise ValueError("必須提供 indices 和 metadatas 或 indices_and_metadata。")
         if len(indices) != len(metadatas):
             raise ValueError("indices 和 metadatas 長度必須一致。")
+    return indices, metadatas
 
-    query_vec = encode_texts(query, model, tokenizer, device, pooling)
-    all_results = []
+# ---- 跨索引 top-k 合併：直接在 NumPy D / I 陣列上進行 ----
+# 各索引的 (nq, k) 結果併成 (nq, 索引數·k)，無效結果 (I < 0) 設為 -inf；
+# 以穩定排序取前 topk，同分時依索引順序、索引內名次排列（與原本逐筆 sorted 相同）。
+# score_calibration 與 indices 對齊，每項為 None 或 (scale, bias)，合併前套用 score·scale + bias。
+# 沒有任何索引時回傳 num_queries 列的空結果。
+def merge_topk(D_list, I_list, topk, score_calibration=None, num_queries=1):
+    if not D_list:
+        # 沒有任何來源時回傳空結果（每筆查詢 0 個候選），與逐筆合併時回傳 [] 一致
+        empty = np.zeros((num_queries, 0), dtype=np.float32)
+        no_rows = np.zeros((num_queries, 0), dtype=np.int64)
+        return empty, no_rows, no_rows, empty
+    scores = []
+    for source, D in enumerate(D_list):
+        D = D.astype(np.float32, copy=True)
+        calibration = score_calibration[source] if score_calibration else None
+        if calibration is not None:
+            scale, bias = calibration
+            D = D * scale + bias
+        scores.append(D)
+    scores = np.concatenate(scores, axis=1)
+    rows = np.concatenate(I_list, axis=1)
+    sources = np.concatenate(
+        [np.full(I.shape, source, dtype=np.int64) for source, I in enumerate(I_list)], axis=1
+    )
+    scores[rows < 0] = -np.inf
 
-    for idx, (index, metadata) in enumerate(zip(indices, metadatas)):
-        D, I = index.search(query_vec, topk)
-        for i, score in enumerate(D[0]):
-            if I[0][i] >= 0:
-                all_results.append(
-                    {
-                        "score": float(score),
-                        **metadata[I[0][i]],
-                        "source": f"index_{idx}",
-                    }
-                )
+    order = np.argsort(-scores, axis=1, kind="stable")[:, :topk]
+    top_scores = np.take_along_axis(scores, order, axis=1)
+    top_rows = np.take_along_axis(rows, order, axis=1)
+    top_sources = np.take_along_axis(sources, order, axis=1)
+    raw_scores = np.take_along_axis(np.concatenate(D_list, axis=1), order, axis=1)
+    return top_scores, top_sources, top_rows, raw_scores
 
-    sorted_results = sorted(all_results, key=lambda x: x["score"], reverse=True)[:topk]
-    return sorted_results
+# 只為最終 top-k 建立結果 dict
+def _materialize_results(merged, metadatas, q, full_record=True, source_names=None):
+    top_scores, top_sources, top_rows, raw_scores = merged
+    results = []
+    for score, source, row, raw in zip(top_scores[q], top_sources[q], top_rows[q], raw_scores[q]):
+        if row < 0:
+            continue
+        record = metadatas[source][row]
+        source_name = source_names[source] if source_names else f"index_{source}"
+        if full_record:
+            result = {"score": float(score), **record, "source": source_name}
+        else:
+            result = {"score": float(score), "text": record["text"], "meta": record["meta"], "source": source_name}
+        if score != raw:
+            result["raw_score"] = float(raw)
+        results.append(result)
+    return results
+
+# 合併多個資料庫搜尋
+def combine_search(
+    query,
+    indices_and_metadata=None,
+    indices=None,
+    metadatas=None,
+    model=None,
+    tokenizer=None,
+    device=None,
+    topk=5,
+    pooling="cls",
+    query_cache=None,
+    score_calibration=None
+):
+    indices, metadatas = _resolve_indices(indices_and_metadata, indices, metadatas)
+
+    query_vec = encode_queries(query, model, tokenizer, device, pooling, query_cache)
+    searched = [index.search(query_vec, topk) for index in indices]
+    merged = merge_topk([D for D, _ in searched], [I for _, I in searched], topk, score_calibration)
+    return _materialize_results(merged, metadatas, 0)
 
 # 簡易多庫搜尋
 def easy_search_all(
@@ -153,23 +1106,174 @@ def easy_search_all(
     tokenizer,
     device,
     topk=5,
-    pooling="cls"
+    pooling="cls",
+    query_cache=None,
+    score_calibration=None
+):
+    query_vec = encode_queries(query, model, tokenizer, device, pooling, query_cache)
+    searched = [index.search(query_vec, topk) for index, _ in index_list]
+    merged = merge_topk([D for D, _ in searched], [I for _, I in searched], topk, score_calibration)
+    return _materialize_results(merged, [metadata for _, metadata in index_list], 0, full_record=False)
+
+# ---- 批次多查詢搜尋：一次編碼全部查詢，每個索引只呼叫一次 index.search ----
+# 回傳與輸入 queries 等長的 list，每個元素與對應單查詢函式的結果格式相同
+
+# 批次基礎搜尋
+def batch_search_with_metadata(
+    queries,
+    index,
+    metadata,
+    model,
+    tokenizer,
+    device,
+    topk=5,
+    pooling="cls",
+    batch_size=32,
+    query_cache=None
+):
+    q_vecs = encode_queries(queries, model, tokenizer, device, pooling, query_cache, batch_size)
+    D, I = index.search(q_vecs, topk)
+    return [
+        [
+            {
+                "score": float(D[q][i]),
+                **metadata[idx],
+            }
+            for i, idx in enumerate(I[q])
+            if idx >= 0
+        ]
+        for q in range(len(q_vecs))
+    ]
+
+# 批次合併多個資料庫搜尋
+def batch_combine_search(
+    queries,
+    indices_and_metadata=None,
+    indices=None,
+    metadatas=None,
+    model=None,
+    tokenizer=None,
+    device=None,
+    topk=5,
+    pooling="cls",
+    batch_size=32,
+    query_cache=None,
+    score_calibration=None
+):
+    indices, metadatas = _resolve_indices(indices_and_metadata, indices, metadatas)
+
+    query_vecs = encode_queries(queries, model, tokenizer, device, pooling, query_cache, batch_size)
+    searched = [index.search(query_vecs, topk) for index in indices]
+    merged = merge_topk([D for D, _ in searched], [I for _, I in searched], topk, score_calibration, len(query_vecs))
+    return [_materialize_results(merged, metadatas, q) for q in range(len(query_vecs))]
+
+# 批次簡易多庫搜尋
+def batch_easy_search_all(
+    queries,
+    index_list,
+    model,
+    tokenizer,
+    device,
+    topk=5,
+    pooling="cls",
+    batch_size=32,
+    query_cache=None,
+    score_calibration=None
 ):
-    query_vec = encode_texts(query, model, tokenizer, device, pooling)
-    all_results = []
-
-    for idx, (index, metadata) in enumerate(index_list):
-        D, I = index.search(query_vec, topk)
-        for score, idx_ in zip(D[0], I[0]):
-            if idx_ >= 0:
-                all_results.append(
-                    {
-                        "score": float(score),
-                        "text": metadata[idx_]["text"],
-                        "meta": metadata[idx_]["meta"],
-                        "source": f"index_{idx}",
-                    }
-                )
-
-    sorted_results = sorted(all_results, key=lambda x: x["score"], reverse=True)[:topk]
-    return sorted_results
+    query_vecs = encode_queries(queries, model, tokenizer, device, pooling, query_cache, batch_size)
+    searched = [index.search(query_vecs, topk) for index, _ in index_list]
+    merged = merge_topk([D for D, _ in searched], [I for _, I in searched], topk, score_calibration, len(query_vecs))
+    metadatas = [metadata for _, metadata in index_list]
+    return [_materialize_results(merged, metadatas, q, full_record=False) for q in range(len(query_vecs))]
+
+# ---- 分片平行搜尋：index.search 交給執行緒池（FAISS 搜尋時會釋放 GIL） ----
+# shards 為 [(index, metadata), ...] 或 [(name, index, metadata), ...]；未命名時 source 為 index_{i}
+# timeout（秒）內未完成的分片不納入合併，並在 last_report 標記為 timeout；
+# 逾時的搜尋仍佔用一個執行緒，在它結束前該分片不再送出新搜尋（標記為 busy），避免卡住的分片耗盡執行緒池
+class ShardedSearcher:
+    def __init__(self, shards, max_workers=None, timeout=None):
+        self.names, self.indices, self.metadatas = [], [], []
+        for i, shard in enumerate(shards):
+            if len(shard) == 3:
+                name, index, metadata = shard
+            else:
+                (index, metadata), name = shard, f"index_{i}"
+            self.names.append(name)
+            self.indices.append(index)
+            self.metadatas.append(metadata)
+        self.timeout = timeout
+        self.last_report = []
+        self._hung = [None] * len(self.indices)
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers or len(self.indices))
+
+    @staticmethod
+    def _search_shard(index, query_vecs, topk):
+        start = time.perf_counter()
+        D, I = index.search(query_vecs, topk)
+        return D, I, time.perf_counter() - start
+
+    # 回傳合併結果（同 merge_topk）與實際參與合併的分片編號
+    def search_vectors(self, query_vecs, topk=5, score_calibration=None):
+        start = time.perf_counter()
+        with self._lock:
+            futures = []
+            for shard, index in enumerate(self.indices):
+                hung = self._hung[shard]
+                if hung is not None and not hung.done():
+                    futures.append(None)
+                else:
+                    self._hung[shard] = None
+                    futures.append(self._executor.submit(self._search_shard, index, query_vecs, topk))
+        wait([future for future in futures if future is not None], timeout=self.timeout)
+
+        report, done = [], []
+        for shard, future in enumerate(futures):
+            entry = {"shard": self.names[shard], "status": "ok", "seconds": None}
+            if future is None:
+                entry["status"] = "busy"
+            elif not future.done():
+                entry["status"] = "timeout"
+                entry["seconds"] = time.perf_counter() - start
+                with self._lock:
+                    self._hung[shard] = future
+            elif future.exception() is not None:
+                entry["status"] = "error"
+                entry["error"] = str(future.exception())
+            else:
+                entry["seconds"] = future.result()[2]
+                done.append(shard)
+            report.append(entry)
+        self.last_report = report
+
+        if not done:
+            raise RuntimeError(f"所有分片搜尋皆失敗或逾時：{report}")
+        results = [futures[shard].result() for shard in done]
+        calibration = [score_calibration[shard] for shard in done] if score_calibration else None
+        merged = merge_topk([D for D, _, _ in results], [I for _, I, _ in results], topk, calibration)
+        return merged, done
+
+    def combine_search(
+        self, query, model, tokenizer, device, topk=5, pooling="cls", query_cache=None, score_calibration=None
+    ):
+        return self.batch_combine_search(
+            [query], model, tokenizer, device, topk, pooling, query_cache=query_cache,
+            score_calibration=score_calibration,
+        )[0]
+
+    def batch_combine_search(
+        self, queries, model, tokenizer, device, topk=5, pooling="cls", batch_size=32, query_cache=None,
+        score_calibration=None
+    ):
+        query_vecs = encode_queries(queries, model, tokenizer, device, pooling, query_cache, batch_size)
+        merged, done = self.search_vectors(query_vecs, topk, score_calibration)
+        metadatas = [self.metadatas[shard] for shard in done]
+        names = [self.names[shard] for shard in done]
+        return [_materialize_results(merged, metadatas, q, source_names=names) for q in range(len(query_vecs))]
+
+    # 各分片最近一次搜尋的延遲，由慢到快排序，方便找出拖慢整體的分片
+    def latency_report(self):
+        return sorted(self.last_report, key=lambda entry: entry["seconds"] or 0.0, reverse=True)
+
+    def close(self):
+        self._executor.shutdown(wait=False)